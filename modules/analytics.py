@@ -0,0 +1,259 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+from collections import Counter, deque
+from multiprocessing import Pool
+from modules.engine import Position, PASS, get_geometry, move_to_text
+from modules.records import record_moves
+from modules.shared import publish_geometry, attach_geometry
+
+'''
+   Verification and statistics of large files of game records.
+
+   Files of records (see modules.records) are read line by line and sent by
+   chunks of lines to a pool of processes, so that only a few chunks are in
+   memory at any time. Each worker replays the games of its chunk with the
+   engine, checks that every move is legal and that the recorded scores are
+   the scores of the final position, and returns the statistics of its chunk
+   (a GameStats). Statistics of the chunks are merged as they arrive:
+   - games, and the games which failed the verification (first ones only),
+   - order of use of the pieces: mean rank of each piece among the pieces of
+     its color (0 for the first piece played),
+   - win rate of the player of each color, and of player 0 for each first
+     move of the game,
+   - distribution of the scores of each color,
+   - branching factor: mean number of legal moves at each ply (the most
+     expensive part, branching = False to skip it).
+'''
+
+###################
+# Class GameStats #
+###################
+class GameStats():
+    '''Statistics of a set of games, which can be merged with the statistics of another set.'''
+    def __init__(self, max_errors = 20):
+        self.max_errors = max_errors
+        self.games = 0
+        self.invalid = 0
+        self.errors = []                  # (game id, message) of the first invalid games
+        self.plies = 0
+        self.piece_ranks = Counter()      # piece name -> sum of its ranks
+        self.piece_counts = Counter()     # piece name -> number of times played
+        self.color_games = Counter()      # color -> games
+        self.color_wins = Counter()       # color -> wins of its player (a draw is half a win)
+        self.opening_games = Counter()    # first move -> games
+        self.opening_wins = Counter()     # first move -> wins of player 0
+        self.scores = dict()              # color -> Counter of scores
+        self.branching_sums = Counter()   # ply -> sum of the numbers of legal moves
+        self.branching_counts = Counter() # ply -> number of positions
+
+    def merge(self, other):
+        self.games += other.games
+        self.invalid += other.invalid
+        self.errors.extend(other.errors[:self.max_errors - len(self.errors)])
+        self.plies += other.plies
+        for name in ['piece_ranks', 'piece_counts', 'color_games', 'color_wins',
+                     'opening_games', 'opening_wins', 'branching_sums', 'branching_counts']:
+            getattr(self, name).update(getattr(other, name))
+        for color, scores in other.scores.items():
+            self.scores.setdefault(color, Counter()).update(scores)
+        return(self)
+
+    def error(self, game_id, message):
+        self.invalid += 1
+        if len(self.errors) < self.max_errors:
+            self.errors.append((game_id, message))
+        return(None)
+
+    def add_record(self, record, game_id = None, branching = True):
+        '''Replays and checks a record, and adds its statistics if it is valid.'''
+        geometry = get_geometry(record['board_size'], record['max_rank'])
+        position = Position(geometry, record['players'])
+        try:
+            moves = record_moves(record, geometry)
+        except ValueError as e:
+            self.error(game_id, str(e))
+            return(None)
+        ranks = [0] * len(position.colors)
+        used = []
+        legal_counts = []
+        for ply, move in enumerate(moves):
+            if position.is_end():
+                self.error(game_id, 'move after the end of the game at ply {}'.format(ply))
+                return(None)
+            if branching:
+                nb_legal = len(position.legal_moves())
+                legal_counts.append(nb_legal)
+            if move == PASS:
+                # A color may only pass when it has no legal placement
+                can_play = nb_legal > 0 if branching else position.has_legal_move()
+                if can_play:
+                    self.error(game_id, 'pass with legal moves at ply {}'.format(ply))
+                    return(None)
+            elif not position.is_legal(move):
+                self.error(game_id, 'illegal move {} at ply {}'.format(move_to_text(geometry, move), ply))
+                return(None)
+            if move != PASS:
+                turn = position.turn
+                used.append((geometry.piece_names[geometry.pieces[move]], ranks[turn]))
+                ranks[turn] += 1
+            position.play(move)
+        if not position.is_end():
+            self.error(game_id, 'game not finished after {} plies'.format(len(moves)))
+            return(None)
+        scores = position.scores()
+        player_scores = {str(k): v for k, v in position.player_scores().items()}
+        if scores != record['scores'] or player_scores != record['player_scores']:
+            self.error(game_id, 'scores {} differ from the final position {}'.format(
+                record['scores'], scores))
+            return(None)
+
+        self.games += 1
+        self.plies += len(moves)
+        for (piece_name, rank) in used:
+            self.piece_ranks[piece_name] += rank
+            self.piece_counts[piece_name] += 1
+        best = max(player_scores.values())
+        winners = [player for player, score in player_scores.items() if score == best]
+        for turn, color in enumerate(position.colors):
+            player = str(position.players[turn])
+            self.color_games[color] += 1
+            self.color_wins[color] += 1.0 / len(winners) if player in winners else 0.0
+            self.scores.setdefault(color, Counter())[scores[color]] += 1
+        if moves:
+            opening = move_to_text(geometry, moves[0])
+            self.opening_games[opening] += 1
+            self.opening_wins[opening] += 1.0 / len(winners) if '0' in winners else 0.0
+        for ply, count in enumerate(legal_counts):
+            self.branching_sums[ply] += count
+            self.branching_counts[ply] += 1
+        return(None)
+
+    def summary(self, min_games = 1):
+        '''Statistics as a dict of plain values (openings played at least min_games times).'''
+        return({
+            'games': self.games,
+            'invalid': self.invalid,
+            'errors': self.errors,
+            'mean_plies': self.plies / self.games if self.games else 0.0,
+            'piece_order': sorted(((name, self.piece_ranks[name] / count, count)
+                                   for name, count in self.piece_counts.items()),
+                                  key = lambda x: x[1]),
+            'color_win_rates': {color: self.color_wins[color] / games
+                                for color, games in self.color_games.items()},
+            'opening_win_rates': {opening: (self.opening_wins[opening] / games, games)
+                                  for opening, games in self.opening_games.most_common()
+                                  if games >= min_games},
+            'scores': {color: {'mean': sum(s * k for s, k in scores.items()) / sum(scores.values()),
+                               'histogram': sorted(scores.items())}
+                       for color, scores in self.scores.items()},
+            'branching': [self.branching_sums[ply] / self.branching_counts[ply]
+                          for ply in sorted(self.branching_counts)],
+        })
+
+# # Example
+# from modules.records import read_records
+# stats = GameStats()
+# for k, record in enumerate(read_records('games.jsonl')):
+#     stats.add_record(record, k)
+# stats.summary()['piece_order'][:5] # pieces played first
+
+###########
+# Workers #
+###########
+def _init_worker(name):
+    if name is not None:
+        attach_geometry(name)
+    return(None)
+
+def analyse_chunk(task):
+    '''GameStats of a chunk (path, number of its first line, lines).'''
+    (path, first_line, lines, branching, max_errors) = task
+    stats = GameStats(max_errors)
+    for k, line in enumerate(lines):
+        game_id = '{}:{}'.format(path, first_line + k + 1)
+        try:
+            record = json.loads(line)
+        except ValueError:
+            stats.error(game_id, 'truncated or invalid line')
+            continue
+        try:
+            stats.add_record(record, record.get('id', game_id), branching)
+        except (KeyError, TypeError, IndexError) as e:
+            stats.error(game_id, 'malformed record: {!r}'.format(e))
+    return(stats)
+
+def read_chunks(paths, chunk_size = 1000):
+    '''Iterates over (path, number of first line, lines) of the non empty lines of the files.'''
+    for path in paths:
+        with open(path) as f:
+            lines = []
+            first_line = 0
+            for k, line in enumerate(f):
+                if not line.strip():
+                    continue
+                if not lines:
+                    first_line = k
+                lines.append(line)
+                if len(lines) == chunk_size:
+                    yield (path, first_line, lines)
+                    lines = []
+            if lines:
+                yield (path, first_line, lines)
+
+def analyse(paths, processes = None, chunk_size = 1000, branching = True,
+            max_errors = 20, max_pending = None, callback = None, board_size = 20, max_rank = 5):
+    '''
+    GameStats of all games of the files of records paths, computed by a pool
+    of processes. At most max_pending chunks (2 per process by default) are
+    read and not yet analysed, so memory does not depend on the size of the
+    files. callback(stats) is called with the merged statistics after each
+    chunk. The geometry (board_size, max_rank) is shared with the workers.
+    '''
+    if isinstance(paths, str):
+        paths = [paths]
+    stats = GameStats(max_errors)
+    block = publish_geometry(get_geometry(board_size, max_rank)) if processes != 1 else None
+    try:
+        with Pool(processes, initializer = _init_worker,
+                  initargs = (block.name if block else None,)) as pool:
+            if max_pending is None:
+                max_pending = 2 * (processes or os.cpu_count() or 1)
+            pending = deque()
+            for (path, first_line, lines) in read_chunks(paths, chunk_size):
+                pending.append(pool.apply_async(analyse_chunk, ((path, first_line, lines,
+                                                                  branching, max_errors),)))
+                while len(pending) >= max_pending:
+                    stats.merge(pending.popleft().get())
+                    if callback is not None:
+                        callback(stats)
+            while pending:
+                stats.merge(pending.popleft().get())
+                if callback is not None:
+                    callback(stats)
+    finally:
+        if block is not None:
+            block.close()
+            block.unlink()
+    return(stats)
+
+# # Example
+# stats = analyse(['selfplay.jsonl', 'tournament.jsonl'],
+#                 callback = lambda s: print(s.games, 'games', s.invalid, 'invalid', flush = True))
+# stats.summary(min_games = 100)['opening_win_rates']
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description = 'Verification and statistics of files of game records')
+    parser.add_argument('paths', nargs = '+')
+    parser.add_argument('--processes', type = int, default = None)
+    parser.add_argument('--chunk-size', type = int, default = 1000)
+    parser.add_argument('--no-branching', action = 'store_true', help = 'skip the branching factor')
+    parser.add_argument('--min-games', type = int, default = 1, help = 'min games of an opening')
+    parser.add_argument('--board-size', type = int, default = 20)
+    args = parser.parse_args()
+
+    stats = analyse(args.paths, args.processes, args.chunk_size, not args.no_branching,
+                    board_size = args.board_size,
+                    callback = lambda s: print(s.games, 'games,', s.invalid, 'invalid', flush = True))
+    print(json.dumps(stats.summary(args.min_games), indent = 1))
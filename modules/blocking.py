@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+from modules.engine import bits
+
+'''
+   Blocking analysis of all the legal moves of a position at once.
+
+   Blocking the corners of the other colors is the main strategic signal of
+   the game. For each move of a list, BlockingAnalyzer computes in one pass
+   over a matrix of moves x cells (NumPy):
+   - occupied[m, k]: live corners of color number k covered by the move,
+   - enclosed[m, k]: live corners of color k left free by the move but which
+     become unusable: no free cell of k remains next to them, so that only the
+     monomino could be put there, and k has no monomino left,
+   - blocked = occupied + enclosed (0 for the color to play),
+   - new_corners[m]: new corners of the color to play opened by the move.
+   A live corner is a corner of Position.anchors which is not already unusable
+   in this way. All arrays are aligned with the list of moves.
+'''
+
+def unpack_cells(masks, nb_cells):
+    '''Matrix (masks x cells) of uint8 of a list of bit sets.'''
+    nb_bytes = (nb_cells + 7) // 8
+    data = np.frombuffer(b''.join(mask.to_bytes(nb_bytes, 'little') for mask in masks),
+                         dtype = np.uint8).reshape(len(masks), nb_bytes)
+    return(np.unpackbits(data, axis = 1, bitorder = 'little')[:, :nb_cells])
+
+def shift(cells, k):
+    '''Columns of cells moved by k (mask << k on each row), with zeros coming in.'''
+    output = np.zeros_like(cells)
+    if k > 0:
+        output[:, k:] = cells[:, :-k]
+    elif k < 0:
+        output[:, :k] = cells[:, -k:]
+    else:
+        output[:] = cells
+    return(output)
+
+##########################
+# Class BlockingAnalyzer #
+##########################
+class BlockingAnalyzer():
+    '''
+    Tables of a geometry for the blocking analysis: the cells of every
+    placement, packed 8 per byte (about 1.6 MB for a board of size 20).
+    '''
+    def __init__(self, geometry):
+        self.geometry = geometry
+        nb_bytes = (geometry.nb_cells + 7) // 8
+        self.placement_bytes = np.frombuffer(
+            b''.join(mask.to_bytes(nb_bytes, 'little') for mask in geometry.masks),
+            dtype = np.uint8).reshape(len(geometry.masks), nb_bytes)
+        self.board = unpack_cells([geometry.board_mask], geometry.nb_cells)[0]
+        self.monomino = geometry.piece_index.get('1')
+
+    def move_cells(self, moves):
+        '''Matrix (moves x cells) of uint8 of placement ids.'''
+        ids = np.asarray(moves, dtype = np.int64)
+        cells = np.unpackbits(self.placement_bytes[ids], axis = 1, bitorder = 'little')
+        return(cells[:, :self.geometry.nb_cells])
+
+    def edge_dilate(self, cells):
+        s = self.geometry.stride
+        return((shift(cells, 1) | shift(cells, -1) | shift(cells, s) | shift(cells, -s)) & self.board)
+
+    def diagonal_dilate(self, cells):
+        s = self.geometry.stride
+        return((shift(cells, s + 1) | shift(cells, s - 1) |
+                shift(cells, -(s - 1)) | shift(cells, -(s + 1))) & self.board)
+
+    def analyze(self, position, moves = None, turn = None):
+        '''
+        Dict of arrays aligned with moves (legal moves of color number turn
+        by default, without PASS): 'moves', 'occupied', 'enclosed', 'blocked'
+        (moves x colors) and 'new_corners'.
+        '''
+        if turn is None:
+            turn = position.turn
+        if moves is None:
+            moves = position.legal_moves(turn)
+        geometry = self.geometry
+        (nb_cells, stride) = (geometry.nb_cells, geometry.stride)
+        nb_colors = len(position.colors)
+        occupied = np.zeros((len(moves), nb_colors), dtype = np.int32)
+        enclosed = np.zeros((len(moves), nb_colors), dtype = np.int32)
+        if not len(moves):
+            return({'moves': np.zeros(0, dtype = np.int64), 'occupied': occupied, 'enclosed': enclosed,
+                    'blocked': occupied + enclosed, 'new_corners': np.zeros(0, dtype = np.int32)})
+        cells = self.move_cells(moves)
+        weights = cells.astype(np.float32)
+
+        for k in range(nb_colors):
+            if k == turn or position.out >> k & 1:
+                continue
+            anchors = list(bits(position.anchors(k)))
+            if self.monomino is None or not position.remaining[k] >> self.monomino & 1:
+                # Without the monomino, a corner with no free cell of k next to it is dead
+                free_mask = geometry.board_mask & ~position.forbidden(k)
+                anchors = [a for a in anchors if geometry.edge_dilate(1 << a) & free_mask]
+                if anchors:
+                    # free[a, c] == 1 when cell c is a free cell of color k next to anchor a
+                    free = np.zeros((len(anchors), nb_cells), dtype = np.float32)
+                    for a, anchor in enumerate(anchors):
+                        for c in (anchor - 1, anchor + 1, anchor - stride, anchor + stride):
+                            if 0 <= c < nb_cells and free_mask >> c & 1:
+                                free[a, c] = 1.0
+                    # Free cells left next to each anchor after each move
+                    left = free.sum(axis = 1)[None, :] - weights @ free.T
+                    enclosed[:, k] = ((left < 0.5) & (cells[:, anchors] == 0)).sum(axis = 1)
+            if anchors:
+                occupied[:, k] = cells[:, anchors].sum(axis = 1)
+
+        # New corners of the color to play
+        occupancy = unpack_cells([position.occupancies[turn]], nb_cells)
+        taken = unpack_cells([position.occupied() | position.anchors(turn)], nb_cells)
+        blocked = taken | cells | self.edge_dilate(occupancy | cells)
+        new_corners = (self.diagonal_dilate(cells) & (1 - blocked)).sum(axis = 1, dtype = np.int32)
+        return({'moves': np.asarray(moves, dtype = np.int64), 'occupied': occupied,
+                'enclosed': enclosed, 'blocked': occupied + enclosed, 'new_corners': new_corners})
+
+    def scores(self, position, moves = None, block_weight = 1.0, corner_weight = 1.0):
+        '''Score of each move: corners blocked to the other players, plus new corners.'''
+        analysis = self.analyze(position, moves)
+        players = position.players
+        player = players[position.turn]
+        others = np.array([players[k] != player for k in range(len(position.colors))], dtype = np.float32)
+        return(block_weight * (analysis['blocked'] @ others) + corner_weight * analysis['new_corners'])
+
+# # Example
+# from modules.engine import Position
+# position = Position()
+# for _ in range(12):
+#     position.play(position.legal_moves()[0])
+# analyzer = BlockingAnalyzer(position.geometry)
+# analysis = analyzer.analyze(position)
+# best = analysis['moves'][np.argmax(analysis['blocked'].sum(axis = 1))]
@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 from modules.piece import BagOfPieces, canonical, contiguous
 from itertools import chain, compress
+from types import MappingProxyType
 
 ######################################################################
 # Possible positions of pieces relative to a corner located at (0,0) #
@@ -151,6 +152,42 @@ possible_positions_before_constraints['b'].pop('Z5', None)
 ###############################################################################
 # Following code needs update.
 
+#######################################
+# Placements anchored at a board cell #
+#######################################
+# For each cell of the board, the positions of pieces of
+# possible_positions_pieces_as_a_dict (relative to a corner at (0,0)) which
+# stay inside the board when the corner is this cell.
+# The table is built once for each (max_rank, board_size) and is read only:
+# all corners of all colors and all boards share it.
+_anchored_tables = dict()
+
+def anchored_positions_table(max_rank = 5, board_size = 20):
+    key = (max_rank, board_size)
+    if key in _anchored_tables:
+        return(_anchored_tables[key])
+
+    # Extent of each relative position: (min x, max x, min y, max y)
+    pieces = possible_positions_pieces_as_a_dict(max_rank, remove_impossible = True)
+    extents = {piece_name: [(tuple(poly), min(a for (a, b) in poly), max(a for (a, b) in poly),
+                             min(b for (a, b) in poly), max(b for (a, b) in poly))
+                            for poly in positions]
+               for piece_name, positions in pieces.items()}
+
+    table = tuple(tuple(MappingProxyType({
+                piece_name: tuple(poly for (poly, min_a, max_a, min_b, max_b) in polys
+                                  if x + min_a >= 0 and x + max_a < board_size
+                                  and y + min_b >= 0 and y + max_b < board_size)
+                for piece_name, polys in extents.items()})
+            for y in range(board_size)) for x in range(board_size))
+    _anchored_tables[key] = table
+    return(table)
+
+# # Example:
+# table = anchored_positions_table(5, 20)
+# len(table[0][0]['I4']) # only the positions going down and right from the corner
+# len(table[10][10]['I4'])
+
 ###############
 # Class Board #
 ###############
@@ -158,38 +195,12 @@ class Corner():
     '''
     A corner and its attributes
     '''
-    def __init__(self, possible_positions_for_pieces, position = (3,4), max_rank = 5, board_size = 20):
+    def __init__(self, position = (3,4), max_rank = 5, board_size = 20):
         self.position = position
-        
-        # Valid positions without outside positions
-        self.valid_positions = set([(x,y) 
-            for x in range(-max_rank+1, max_rank) 
-            for y in range(-max_rank+1, max_rank) 
-            if ((abs(x)+abs(y) < max_rank) 
-               and (position[0]+x >= 0) and (position[1]+y >= 0)
-               and (position[0]+x < board_size) and (position[1]+y < board_size))])
-       
-        # We take all possible positions for pieces
-        self.valid_pieces = possible_positions_for_pieces
-        # We remove pieces which are not all valid positions    
-        print('We are', len(self.valid_pieces['I4']))
-        print(self.valid_pieces['I4'])
-        
-        for piece_name, positions in self.valid_pieces.items():
-            #if piece_name == 'I4':
-            #    print(piece_name)
-                idx_keep = [set(piece).issubset(self.valid_positions) for piece in positions]
-                self.valid_pieces[piece_name] = list(compress(self.valid_pieces[piece_name], idx_keep))
-            #    print(self.valid_pieces[piece_name])
-                
-#                for piece in positions:
-#                    print(set(piece))
-#                    if not set(piece).issubset(self.valid_positions):
-#                        #valid_pieces_COPY[piece_name].remove(piece)
-#                        print('Piece removed')
-        #self.valid_pieces = valid_pieces_COPY
-            
-        #valid_positions_from_corners
+        # Positions of pieces (relative to the corner) inside the board: a
+        # read only view of the shared table, the same for all colors
+        (x, y) = position
+        self.valid_pieces = anchored_positions_table(max_rank, board_size)[x][y]
 
 
 valid_pieces = possible_positions_pieces_as_a_dict(max_rank, remove_impossible = True)
@@ -251,8 +262,7 @@ class Board():
         for color in self.corners.keys():
             self.corners_objects[color] = dict()
             for position in self.corners[color]:
-                possible_positions_for_pieces = self.valid_positions_from_corners[color]
-                self.corners_objects[color][position] = Corner(possible_positions_for_pieces, position, max_rank, board_size)
+                self.corners_objects[color][position] = Corner(position, max_rank, board_size)
             
 
         self.length_of_one_turn = len(colors)
@@ -302,7 +312,7 @@ board_size = 20
 my_board = Board('2 players 4 colors', max_rank, board_size)
 for key, val in my_board.corners_objects['b'].items():
     print(val.position)
-    my_valid_positions = val.valid_positions
+    my_valid_pieces = val.valid_pieces
 
 
 for piece_name, positions in my_board.valid_positions_from_corners['b'].items():
@@ -4,8 +4,8 @@ import numpy as np
 import matplotlib as mpl
 import matplotlib.pyplot as plt
 
-#from modules.piece import BagOfPieces
-from piece import BagOfPieces
+from modules.piece import BagOfPieces
+from modules.engine import Position, PASS, get_geometry
 
 
 ###############
@@ -29,9 +29,6 @@ def define_color2player() :
 # color2player = define_color2player()
 # color2player
 
-color2player = define_color2player()
-print(color2player)
-
 
 
 class Board:
@@ -60,8 +57,20 @@ class Board:
         
         # keep relevant quantities
         self.board_size = board_size
+        self.color2player = color2player
         self.to_play = self.colors[0] # current player, initialized at first color to be played
         
+        # position of the game for the engine (modules.engine), used to check
+        # moves and to let bots think: colors discarded are out of the game
+        all_colors = ['blue', 'yellow', 'red', 'green']
+        self.position = Position(get_geometry(board_size, max_rank),
+                                 [color2player.get(color, 0) for color in all_colors])
+        for i, color in enumerate(all_colors):
+            if color not in self.colors:
+                self.position.out |= 1 << i
+        if self.position.out >> self.position.turn & 1:
+            self.position.next_turn()
+        
         #self.color2player = color2player
         #self.players = color2player.values()
     
@@ -93,6 +102,13 @@ class Board:
         plt.show()
 
         
+    def save_image(self, path, cell_size = 12):
+        '''Saves the board as a PNG file, without matplotlib (see modules.render).'''
+        from modules.render import Renderer, save_png
+        save_png(Renderer(self.board_size, cell_size).render_board(self), path)
+        return
+    
+    
     def show_available_pieces(self, color):
         '''Prints the remaining available pieces of a given color.'''
         bag = self.bags[color]
@@ -106,31 +122,16 @@ class Board:
         '''Returns True whether the given piece at the given orientation and given position
            on the board fits to the current state of the game, else returns False.
         '''
-        bag = self.bags[color]
-        played_piece = bag.selectPiece(piece_name)
-        surface_np =  np.array(played_piece.forms[orientation]) + np.array(position)
-        surface = [tuple(pt) for pt in surface_np]
-        
-        # 1) tests whether piece fits on the board
-        if  minima(surface)[0] < 0 or \
-            minima(surface)[1] < 0 or \
-            maxima(surface)[0] > self.board_size or \
-            maxima(surface)[1] > self.board_size :
-                return False
+        # 1) tests whether piece fits on the board: only such placements have an id
+        move = self.position.geometry.ids.get((piece_name, orientation, tuple(position)))
+        if move is None :
+            return False
         
         # 2) if game starts, piece must cover the board angle corresponding to current color to play
-        if len(bag) == 21 :
-            # TODO
-            return
-            
         # 3) piece must not cross already occupied positions on board
-        # TODO
-        
         # 4) boundary(piece) must cross positions already occupied by the given color
-        # TODO
-        
-        #if all true, returns True
-        return True
+        #    (by a corner, never by an edge), and the piece must still be in the bag
+        return self.position.is_legal(move, self.position.colors.index(color[0]))
 
 
     def scores(self, last_piece_name = None):
@@ -148,8 +149,34 @@ class Board:
     
     def is_end(self):
         '''Returns True if game is over, else False.'''
-        #TODO
-        return
+        return self.position.is_end()
+    
+    
+    def to_bytes(self):
+        '''Compact snapshot of the game (see Position.to_bytes in modules.engine).'''
+        return self.position.to_bytes()
+    
+    
+    @staticmethod
+    def from_bytes(data):
+        '''Board restored from Board.to_bytes(); colors of player 0 are discarded.'''
+        position = Position.from_bytes(data)
+        all_colors = ['blue', 'yellow', 'red', 'green']
+        color2player = {color: player for color, player in zip(all_colors, position.players) if player != 0}
+        geometry = position.geometry
+        board = Board(color2player, geometry.board_size, geometry.max_rank)
+        board.position = position
+        for i, color in enumerate(all_colors) :
+            if color in board.colors :
+                for pt in geometry.points(position.occupancies[i]) :
+                    board.occupancies[color][pt] = 1
+                bag = board.bags[color]
+                for piece in list(bag) :
+                    if not position.remaining[i] >> geometry.piece_index[piece.name] & 1 :
+                        bag.pieces.remove(piece)
+                        bag.remove(piece)
+        board.to_play = all_colors[position.turn]
+        return board
     
     
     def init_board(self) :
@@ -161,8 +188,9 @@ class Board:
     def remove_piece_from_bag(self, piece_name):
         '''Remove a piece from current color's bag.'''
         bag = self.bags[self.to_play]
-        played_piece = bag.selectPieceByName(piece_name)
-        bag.pieces.remove(played_piece) # or bag.remove(played_piece)
+        played_piece = bag.selectPiece(piece_name)
+        bag.pieces.remove(played_piece)
+        bag.remove(played_piece)
         return
     
                           
@@ -182,43 +210,93 @@ class Board:
         '''Move from a color to the next in the set of colors assigned to a game, 
            with colors ordered as : 'blue', 'yellow', 'red', 'green'.
         '''
-        for i, color in enumerate(self.colors) :
-            if self.to_play == color:
-                j = i+1 % len(self.colors)
-                self.to_play = self.colors[j]
+        i = self.colors.index(self.to_play)
+        for step in range(1, len(self.colors) + 1) :
+            color = self.colors[(i + step) % len(self.colors)]
+            # colors which can not play anymore are skipped
+            if not self.position.out >> self.position.colors.index(color[0]) & 1 :
+                self.to_play = color
                 return
         
     
     # ------------- perform a move -----------------
     def apply_move(self, color, piece_name, orientation, position) :
-        self.remove_piece_from_bag(piece_name)
         self.put_piece_on_board(color, piece_name, orientation, position)
+        self.remove_piece_from_bag(piece_name)
+        self.position.apply_move(color[0], piece_name, orientation, position)
+        self.update_player()
+        return
+    
+    
+    def pass_move(self):
+        '''Current color can not play anymore.'''
+        self.position.play(PASS)
         self.update_player()
         return
     
     
-    def forward(self):
-        # 1) dysplaying available pieces and orientations to current player
-        self.show_available_pieces(self.to_play)
+    def forward(self, bots = None):
+        '''Plays the turn of the current color. bots is a dict assigning a bot
+           (see modules.mcts.MCTSPlayer) to some players; the other players are
+           humans. While a human thinks, the bots ponder on the position.
+        '''
+        bots = bots or {}
+        color = self.to_play
+        geometry = self.position.geometry
+        piece_name = None
         
-        done = False
-        while done == False :
-            # 2) retrieve playing act
-            # TODO
-            #piece, orientation, position = input('which action ?')
+        if not self.position.has_legal_move() :
+            print('no available move for color {}'.format(color))
+            # only the pondering bots are on this position
+            for bot in set(bots.values()) :
+                if bot.pondering is not None :
+                    bot.stop_pondering(PASS)
+            self.pass_move()
             
-            # 3) either update game state or raise error
-            if self.is_allowed(self.to_play, piece_name, orientation, position) :
-                self.apply_move(self.to_play, piece_name, orientation, position)
-                done = True
+        elif self.color2player[color] in bots :
+            move = bots[self.color2player[color]].choose_move(self.position)
+            if move == PASS :
+                print('{} passes'.format(color))
+                self.pass_move()
             else :
-                #raise error 
-                print('invalid action')
+                piece_name, orientation, position = geometry.placements[move]
+                print('{} plays {} {} {}'.format(color, piece_name, orientation, position))
+                self.apply_move(color, piece_name, orientation, position)
+            
+        else :
+            # 1) dysplaying available pieces and orientations to current player
+            self.show_available_pieces(color)
+            for bot in set(bots.values()) :
+                bot.ponder(self.position)
+            
+            done = False
+            while done == False :
+                # 2) retrieve playing act
+                act = input('which action ? (piece orientation x y, e.g. V5 rr 5 5) : ').split()
+                try :
+                    piece_name, orientation, position = act[0], act[1], (int(act[2]), int(act[3]))
+                except (IndexError, ValueError) :
+                    print('invalid action')
+                    continue
+                
+                # 3) either update game state or raise error
+                if self.is_allowed(color, piece_name, orientation, position) :
+                    done = True
+                else :
+                    #raise error 
+                    print('invalid action')
+            
+            # bots keep what they found for the position after this move
+            move = geometry.ids[(piece_name, orientation, position)]
+            for bot in set(bots.values()) :
+                bot.stop_pondering(move)
+            self.apply_move(color, piece_name, orientation, position)
                 
-            # 4) if end of game print scores
-            if self.is_end() :
-                scores = self.scores(last_piece_name = piece_name)
-                print(scores)
+        # 4) if end of game print scores
+        if self.is_end() :
+            scores = self.scores(last_piece_name = piece_name)
+            print(scores)
+        return
                 
    
                 
@@ -227,17 +305,28 @@ class Board:
 
 
     
-# # Ex :
-board = Board(color2player, board_size = 10)
-print(board.colors)
-print(board.to_play)
-print(board.occupancies[board.to_play])
-board.show_available_pieces(board.to_play)
+# # Ex : human against a bot which ponders during human turns
+# from modules.mcts import MCTSPlayer
+# board = Board({'blue': 1, 'yellow': 2, 'red': 1, 'green': 2})
+# bots = {2: MCTSPlayer(simulations = 500)}
+# while not board.is_end():
+#     board.forward(bots)
 
-board.init_board()
-board.put_piece_on_board(color = board.to_play, piece_name = 'V5', orientation = 'rr', position = (5, 5))
-board.update_player()
-board.put_piece_on_board(color = board.to_play, piece_name = '2', orientation = 'r', position = (2,1))
-board.update_player()
-board.put_piece_on_board(color = board.to_play, piece_name = 'X', orientation = 'c', position = (5,3))
-board.show()
+if __name__ == '__main__':
+    color2player = define_color2player()
+    print(color2player)
+
+    # # Ex :
+    board = Board(color2player, board_size = 10)
+    print(board.colors)
+    print(board.to_play)
+    print(board.occupancies[board.to_play])
+    board.show_available_pieces(board.to_play)
+    
+    board.init_board()
+    board.put_piece_on_board(color = board.to_play, piece_name = 'V5', orientation = 'rr', position = (5, 5))
+    board.update_player()
+    board.put_piece_on_board(color = board.to_play, piece_name = '2', orientation = 'r', position = (2,1))
+    board.update_player()
+    board.put_piece_on_board(color = board.to_play, piece_name = 'X', orientation = 'c', position = (5,3))
+    board.show()
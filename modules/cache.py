@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+import sys
+from array import array
+from collections import OrderedDict
+
+'''
+   Bounded cache of legal moves.
+
+   Move generation is the most expensive part of a node of a search, and the
+   same positions are met many times (transpositions, searches repeated from
+   the same position, tree reuse). MoveCache keeps the legal moves of the
+   positions recently seen, keyed by Position.key(), and drops the least
+   recently used positions when its memory goes over max_bytes.
+'''
+
+# Memory of an entry besides its array of moves: key, slot of the
+# OrderedDict and its links
+ENTRY_OVERHEAD = 100
+
+###################
+# Class MoveCache #
+###################
+class MoveCache():
+    def __init__(self, max_bytes = 64 << 20):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def legal_moves(self, position):
+        '''Legal moves of the color to play (see Position.legal_moves).'''
+        key = position.key()
+        moves = self.entries.get(key)
+        if moves is not None:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return(list(moves))
+        self.misses += 1
+        output = position.legal_moves()
+        self.add(key, array(position.geometry.move_typecode, output))
+        return(output)
+
+    def add(self, key, moves):
+        size = sys.getsizeof(moves) + ENTRY_OVERHEAD
+        if size > self.max_bytes:
+            return(None)
+        self.entries[key] = moves
+        self.nbytes += size
+        while self.nbytes > self.max_bytes:
+            (_, old) = self.entries.popitem(last = False)
+            self.nbytes -= sys.getsizeof(old) + ENTRY_OVERHEAD
+            self.evictions += 1
+        return(None)
+
+    def clear(self):
+        self.entries.clear()
+        self.nbytes = 0
+        return(None)
+
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return(self.hits / total if total else 0.0)
+
+    def stats(self):
+        return({'entries': len(self.entries), 'bytes': self.nbytes,
+                'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions, 'hit_rate': self.hit_rate()})
+
+# # Example
+# from modules.engine import Position
+# cache = MoveCache(max_bytes = 16 << 20)
+# position = Position()
+# cache.legal_moves(position) # computed
+# cache.legal_moves(position) # from the cache
+# cache.stats()
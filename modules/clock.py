@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+import math
+import time
+from modules.engine import popcount
+
+'''
+   Time management for the anytime search players.
+
+   A search player implements think(position, deadline, soft_deadline = None):
+   it searches until time.monotonic() reaches deadline and returns its best
+   move so far (best_move() can also be read at any moment). Between
+   soft_deadline and deadline it only goes on while its best move is not
+   stable.
+
+   TimeManager splits the remaining time of the game clock of a color between
+   its expected number of moves, estimated from the pieces left in its bag:
+   each move gets the remaining time divided by this number (soft deadline),
+   and at most extension times more when the best move is unstable (hard
+   deadline), always keeping a safety margin of the clock.
+'''
+
+def expected_moves(position, turn = None, playable = 0.75):
+    '''
+    Expected number of moves left for color number turn: a fraction playable
+    of its remaining pieces (some pieces never find room on the board).
+    '''
+    if turn is None:
+        turn = position.turn
+    if position.out >> turn & 1:
+        return(0)
+    return(max(1, int(math.ceil(playable * popcount(position.remaining[turn])))))
+
+#####################
+# Class TimeManager #
+#####################
+class TimeManager():
+    '''
+    increment is the time added to the clock after each move, margin the time
+    kept for the latency of the network, extension the factor of the soft
+    budget allowed when the best move is unstable.
+    '''
+    def __init__(self, increment = 0.0, margin = 0.05, extension = 2.0, min_time = 0.005):
+        self.increment = increment
+        self.margin = margin
+        self.extension = extension
+        self.min_time = min_time
+
+    def budget(self, position, remaining):
+        '''(soft, hard) number of seconds for the next move, with remaining seconds on the clock.'''
+        usable = max(remaining - self.margin, self.min_time)
+        soft = usable / expected_moves(position) + self.increment
+        hard = min(soft * self.extension, usable / 2 + self.increment, usable)
+        soft = min(soft, hard)
+        return(max(soft, self.min_time), max(hard, self.min_time))
+
+    def deadlines(self, position, remaining, now = None):
+        '''(soft_deadline, deadline) in time.monotonic() time, for think().'''
+        if now is None:
+            now = time.monotonic()
+        (soft, hard) = self.budget(position, remaining)
+        return(now + soft, now + hard)
+
+    def move_deadline(self, ms, now = None):
+        '''Deadline for a move limited to ms milliseconds (e.g. 'go' of modules.server).'''
+        if now is None:
+            now = time.monotonic()
+        return(now + max(ms / 1000.0 - self.margin, self.min_time))
+
+# # Example: a game with 60 seconds per color
+# from modules.engine import Position
+# from modules.mcts import MCTSPlayer
+# position = Position()
+# player = MCTSPlayer()
+# manager = TimeManager()
+# clock = 60.0
+# start = time.monotonic()
+# (soft_deadline, deadline) = manager.deadlines(position, clock, start)
+# move = player.think(position, deadline, soft_deadline)
+# clock -= time.monotonic() - start
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+import time
+from modules.engine import PASS
+
+'''
+   Exact endgame solver for two players games.
+
+   When few moves are left, the game tree is small enough to be searched
+   until the end. The value of a final position is the score of the first
+   player minus the score of the second one, with the rules of
+   Position.scores() (bonus of 15, or 20 when the monomino is the last piece).
+   The search is an alpha-beta with a transposition table keyed by
+   Position.key(), trying first the best move already found for the position,
+   then the largest pieces.
+'''
+
+EXACT, LOWER, UPPER = 0, 1, 2
+
+def remaining_moves_estimate(position):
+    '''
+    Estimate of the size of the rest of the game: number of moves that the
+    colors still in game could play now. Counting only the pieces or the
+    corners left is not enough: a color with few corners but many pieces
+    keeps opening new corners, and the tree stays too big to be solved.
+    '''
+    return(sum(len(position.legal_moves(turn)) for turn in range(len(position.colors))))
+
+class SearchLimit(Exception):
+    '''Raised when the solver visits more than max_nodes positions, or is late.'''
+    pass
+
+#######################
+# Class EndgameSolver #
+#######################
+class EndgameSolver():
+    '''
+    Solves positions whose remaining_moves_estimate is at most max_moves.
+    A search visiting more than max_nodes positions is abandoned. The
+    transposition table is kept from a search to the next one, and emptied
+    when it has more than max_table positions. With a MoveOrdering
+    (modules.ordering), moves are tried in its order, and the moves causing
+    a cutoff are rewarded in its history.
+    '''
+    def __init__(self, max_moves = 25, max_nodes = 200000, max_table = 1 << 20, ordering = None):
+        self.max_moves = max_moves
+        self.ordering = ordering
+        self.max_nodes = max_nodes
+        self.max_table = max_table
+        self.table = dict()
+        self.nodes = 0
+        self.deadline = None
+
+    def applies(self, position):
+        return(not position.is_end() and len(set(position.players)) == 2
+               and remaining_moves_estimate(position) <= self.max_moves)
+
+    def value(self, position):
+        '''Final value for the first player of position.players.'''
+        scores = position.player_scores()
+        first = position.players[0]
+        return(sum(score if player == first else -score for player, score in scores.items()))
+
+    def solve(self, position, deadline = None):
+        '''
+        Exact (value, best move) for the player to move, value being its score
+        minus the score of the other player, or None if the search was too big
+        or not finished at deadline (in time.monotonic() time).
+        '''
+        if len(set(position.players)) != 2:
+            raise ValueError('The endgame solver only solves two players games')
+        self.nodes = 0
+        self.deadline = deadline
+        self.sizes = position.geometry.piece_sizes
+        if len(self.table) > self.max_table:
+            self.table.clear()
+        try:
+            value = self.search(position, -10 ** 6, 10 ** 6)
+        except SearchLimit:
+            return(None)
+        (_, _, move) = self.table[position.key()]
+        if position.players[position.turn] != position.players[0]:
+            value = -value
+        return(value, move)
+
+    def order(self, position, moves, hint):
+        if self.ordering is not None:
+            moves = self.ordering.order(position, moves)
+        else:
+            sizes = self.sizes
+            pieces = position.geometry.pieces
+            moves = sorted(moves, key = lambda move: -sizes[pieces[move]])
+        if hint in moves:
+            moves.remove(hint)
+            moves.insert(0, hint)
+        return(moves)
+
+    def search(self, position, alpha, beta):
+        '''Alpha-beta value for the first player of position.players.'''
+        if position.is_end():
+            return(self.value(position))
+        self.nodes += 1
+        if self.nodes > self.max_nodes:
+            raise SearchLimit()
+        if self.deadline is not None and self.nodes % 256 == 0 and time.monotonic() > self.deadline:
+            raise SearchLimit()
+
+        key = position.key()
+        hint = None
+        entry = self.table.get(key)
+        if entry is not None:
+            (value, flag, hint) = entry
+            if flag == EXACT or (flag == LOWER and value >= beta) or (flag == UPPER and value <= alpha):
+                return(value)
+
+        moves = position.legal_moves()
+        moves = self.order(position, moves, hint) if moves else [PASS]
+        maximize = position.players[position.turn] == position.players[0]
+        (alpha0, beta0) = (alpha, beta)
+        best = None
+        best_move = moves[0]
+        for move in moves:
+            child = position.copy()
+            child.play(move)
+            value = self.search(child, alpha, beta)
+            if maximize and (best is None or value > best):
+                (best, best_move) = (value, move)
+                alpha = max(alpha, value)
+            elif not maximize and (best is None or value < best):
+                (best, best_move) = (value, move)
+                beta = min(beta, value)
+            if alpha >= beta:
+                if self.ordering is not None:
+                    self.ordering.update(move, 1.0)
+                break
+
+        if best <= alpha0:
+            flag = UPPER
+        elif best >= beta0:
+            flag = LOWER
+        else:
+            flag = EXACT
+        self.table[key] = (best, flag, best_move)
+        return(best)
+
+# # Example
+# import random
+# from modules.engine import Position
+# position = Position()
+# solver = EndgameSolver(max_moves = 25)
+# while not solver.applies(position):
+#     moves = position.legal_moves()
+#     position.play(random.choice(moves) if moves else PASS)
+# solver.solve(position) # (value, best move)
@@ -0,0 +1,616 @@
+# -*- coding: utf-8 -*-
+import struct
+import sys
+from array import array
+from modules.piece import BagOfPieces, maxima
+
+'''
+   Fast legality engine based on bitboards.
+
+   The board is stored as Python integers used as bit sets. Cell (x, y) of a
+   board of size n is bit number x * (n + 1) + y: each row has one extra
+   padding column which is never part of the board, so that a shift by one
+   bit never wraps a piece from one side of the board to the other.
+
+   All placements of all pieces (every piece, every orientation given by
+   Piece.forms, every position fitting inside the board) are enumerated once
+   in a Geometry object. A placement is identified by its index in those
+   tables (the placement id), and a move is either a placement id or PASS.
+   Placement ids fit in 16 bits up to boards of size 20 with the max rank 5
+   (30433 placements): lists of moves can be stored in arrays of
+   Geometry.move_typecode, and the piece, orientation and first cell of a
+   placement are read from flat tables instead of tuples of strings.
+
+   The naming of the rest of the repository is kept:
+   - colors are 'b', 'y', 'r', 'g' and play in this order,
+   - a placement is (piece_name, orientation, position), for example
+     ('V5', 'rr', (5, 5)), where position is added to every point of
+     piece.forms[orientation] as in Board.put_piece_on_board.
+'''
+
+COLORS = ['b', 'y', 'r', 'g']
+ORIENTATIONS = ['c', 'r', 'rr', 'rrr', 's', 'rs', 'rrs', 'rrrs']
+PASS = -1
+
+def start_cells(board_size):
+    '''Cell that the first piece of each color must cover.'''
+    n = board_size - 1
+    return({'b': (n, 0), 'y': (0, 0), 'r': (0, n), 'g': (n, n)})
+# start_cells(20) # {'b': (19, 0), 'y': (0, 0), 'r': (0, 19), 'g': (19, 19)}
+
+##################
+# Class Geometry #
+##################
+class Geometry():
+    '''
+    Tables of all placements for a given board size and max rank.
+    Those tables do not depend on the state of the game, they are built once
+    and shared by all positions (see get_geometry).
+    '''
+    def __init__(self, board_size = 20, max_rank = 5):
+        self.board_size = board_size
+        self.max_rank = max_rank
+        self.stride = board_size + 1
+        self.nb_cells = board_size * self.stride
+        self.board_mask = sum(1 << self.cell(x, y)
+                              for x in range(board_size) for y in range(board_size))
+
+        bag = BagOfPieces(None, None, max_rank)
+        self.piece_names = [piece.name for piece in bag]
+        self.piece_index = {name: i for i, name in enumerate(self.piece_names)}
+        self.piece_sizes = [len(piece) for piece in bag]
+        self.all_pieces = (1 << len(bag)) - 1
+
+        # Placement tables, indexed by placement id
+        self.placements = [] # (piece_name, orientation, position)
+        self.masks = []      # cells covered by the placement
+        self.pieces = array('B')       # index of the piece in piece_names
+        self.orientations = array('B') # index of the orientation in ORIENTATIONS
+        self.origins = array('H')      # cell of the position
+        self.ids = dict()    # (piece_name, orientation, position) -> placement id
+
+        # by_cell[cell][piece index] is the list of placement ids of this piece
+        # covering this cell
+        self.by_cell = [[[] for _ in bag] for _ in range(self.nb_cells)]
+
+        for i, piece in enumerate(bag):
+            for orientation, form in piece.forms.items():
+                (h, w) = maxima(form)
+                for x in range(board_size - h):
+                    for y in range(board_size - w):
+                        cells = [self.cell(x + a, y + b) for (a, b) in form]
+                        pid = len(self.masks)
+                        self.placements.append((piece.name, orientation, (x, y)))
+                        self.masks.append(sum(1 << c for c in cells))
+                        self.pieces.append(i)
+                        self.orientations.append(ORIENTATIONS.index(orientation))
+                        self.origins.append(self.cell(x, y))
+                        self.ids[(piece.name, orientation, (x, y))] = pid
+                        for c in cells:
+                            self.by_cell[c][i].append(pid)
+        self.move_typecode = move_typecode(len(self.masks))
+        self.set_priorities()
+
+    def set_priorities(self):
+        '''Orders of the lazy move generation (see Position.iter_moves).'''
+        # Largest pieces first
+        self.size_order = sorted(range(len(self.piece_names)), key = lambda i: -self.piece_sizes[i])
+        # Corners near the center of the board first: they open the most room
+        n = self.board_size
+        self.cell_priority = array('H', [0]) * self.nb_cells
+        for x in range(n):
+            for y in range(n):
+                self.cell_priority[self.cell(x, y)] = abs(2 * x - n + 1) + abs(2 * y - n + 1)
+
+    def decode(self, move):
+        '''(piece_name, orientation, position) of a placement id, from the flat tables.'''
+        return((self.piece_names[self.pieces[move]], ORIENTATIONS[self.orientations[move]],
+                self.point(self.origins[move])))
+
+    def cell(self, x, y):
+        '''Bit number of the point (x, y).'''
+        return(x * self.stride + y)
+
+    def point(self, cell):
+        '''Point (x, y) of a bit number.'''
+        return(divmod(cell, self.stride))
+
+    def points(self, mask):
+        '''List of points (x, y) of a bit set.'''
+        return([self.point(c) for c in bits(mask)])
+
+    def placement_of(self, mask):
+        '''Placement id covering exactly the cells of mask, or None.'''
+        cell = (mask & -mask).bit_length() - 1
+        if not 0 <= cell < self.nb_cells:
+            return(None)
+        for by_piece in self.by_cell[cell]:
+            for pid in by_piece:
+                if self.masks[pid] == mask:
+                    return(pid)
+        return(None)
+
+    def compress(self, mask):
+        '''Bit set without the padding column: cell (x, y) is bit x * n + y.'''
+        n = self.board_size
+        row = (1 << n) - 1
+        output = 0
+        for x in range(n):
+            output |= ((mask >> (x * self.stride)) & row) << (x * n)
+        return(output)
+
+    def expand(self, packed):
+        '''Inverse of compress.'''
+        n = self.board_size
+        row = (1 << n) - 1
+        output = 0
+        for x in range(n):
+            output |= ((packed >> (x * n)) & row) << (x * self.stride)
+        return(output)
+
+    def edge_dilate(self, mask):
+        '''Cells sharing an edge with a cell of mask.'''
+        s = self.stride
+        return(((mask << 1) | (mask >> 1) | (mask << s) | (mask >> s)) & self.board_mask)
+
+    def diagonal_dilate(self, mask):
+        '''Cells sharing a corner with a cell of mask.'''
+        s = self.stride
+        return(((mask << (s + 1)) | (mask << (s - 1)) |
+                (mask >> (s - 1)) | (mask >> (s + 1))) & self.board_mask)
+
+# # Example
+# geometry = Geometry(board_size = 20, max_rank = 5)
+# len(geometry.placements) # number of placements on an empty board
+# pid = geometry.ids[('V5', 'rr', (5, 5))]
+# geometry.points(geometry.masks[pid])
+
+def move_typecode(nb_placements):
+    '''Typecode of array for placement ids and PASS stored as move + 1: 16 bits when they fit.'''
+    return('H' if nb_placements < 0xffff else 'I')
+
+_geometries = dict()
+
+def get_geometry(board_size = 20, max_rank = 5):
+    '''Geometry for (board_size, max_rank), built only once per process.'''
+    key = (board_size, max_rank)
+    if key not in _geometries:
+        _geometries[key] = Geometry(board_size, max_rank)
+    return(_geometries[key])
+
+def bits(mask):
+    '''Iterates over the bit numbers set in mask.'''
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
+def popcount(mask):
+    '''Number of bits set in mask.'''
+    return(bin(mask).count('1'))
+
+##################
+# Class Position #
+##################
+class Position():
+    '''
+    State of a game: for each color, the cells occupied on the board and the
+    pieces remaining in its bag, the color to play and the colors which can not
+    play anymore.
+    Default players are those of the '2 players 4 colors' game; with a
+    variant (see modules.variants), its colors, players, start cells and
+    pieces are used instead.
+    '''
+    def __init__(self, geometry = None, players = (0, 1, 0, 1), variant = None):
+        if geometry is None:
+            geometry = get_geometry() if variant is None else variant.geometry()
+        self.geometry = geometry
+        self.variant = variant
+        if variant is None:
+            self.colors = list(COLORS)
+            self.players = list(players)
+            starts = start_cells(geometry.board_size)
+            all_pieces = geometry.all_pieces
+        else:
+            self.colors = list(variant.colors)
+            self.players = list(variant.players)
+            starts = variant.start_cells(geometry.board_size)
+            all_pieces = variant.piece_mask(geometry)
+        if len(self.colors) != len(self.players):
+            raise ValueError("Size of lists 'colors' and 'players' must be equal")
+        self.starts = [1 << geometry.cell(*starts[color]) for color in self.colors]
+
+        self.occupancies = [0] * len(self.colors)
+        self.remaining = [all_pieces] * len(self.colors)
+        self.last_piece = [None] * len(self.colors)
+        self.out = 0  # bit i is set when color i can not play anymore
+        self.turn = 0 # index of the color to play
+        self.ply = 0
+
+    ##
+    # Snapshot
+    ##
+    # A position is written as a record of fixed size, about 180 bytes for a
+    # 20 x 20 board (little endian):
+    # - board_size, max_rank, number of the variant (0 without variant, see
+    #   modules.variants), then the player of each color (1 byte each),
+    # - three planes of one bit per cell (without the padding column):
+    #   occupied cells, cells of color 1 or 3, cells of color 2 or 3 (at
+    #   most four colors),
+    #   from which the occupancy of each color is restored with a few
+    #   operations on integers,
+    # - the remaining pieces of each color (one bit per piece),
+    # - color to play, colors out of the game, colors whose last piece was the
+    #   monomino '1' (1 byte each), ply (2 bytes), key() (8 bytes).
+    # Anchors and forbidden cells are not written: they are computed from the
+    # occupancies when they are needed.
+    def to_bytes(self):
+        geometry = self.geometry
+        occupancies = [geometry.compress(mask) for mask in self.occupancies]
+        (o0, o1, o2, o3) = occupancies + [0] * (4 - len(occupancies))
+        plane = (geometry.board_size ** 2 + 7) // 8
+        pieces = (len(geometry.piece_names) + 7) // 8
+        monomino = sum(1 << i for i, name in enumerate(self.last_piece) if name == '1')
+        code = self.variant.code if self.variant is not None else 0
+        return(b''.join([
+            bytes([geometry.board_size, geometry.max_rank, code] + self.players),
+            (o0 | o1 | o2 | o3).to_bytes(plane, 'little'),
+            (o1 | o3).to_bytes(plane, 'little'),
+            (o2 | o3).to_bytes(plane, 'little'),
+            b''.join(r.to_bytes(pieces, 'little') for r in self.remaining),
+            struct.pack('<BBBHq', self.turn, self.out, monomino, self.ply, self.key()),
+        ]))
+
+    @staticmethod
+    def from_bytes(data, geometry = None):
+        '''Position written by to_bytes(). ValueError if data is corrupted.'''
+        (board_size, max_rank, code) = data[0], data[1], data[2]
+        if geometry is None:
+            geometry = get_geometry(board_size, max_rank)
+        position = Position.__new__(Position)
+        position.geometry = geometry
+        if code == 0:
+            position.variant = None
+            position.colors = list(COLORS)
+            starts = start_cells(board_size)
+        else:
+            # Imported here: modules.variants imports this module
+            from modules.variants import variant_of_code
+            position.variant = variant_of_code(code)
+            position.colors = list(position.variant.colors)
+            starts = position.variant.start_cells(board_size)
+        nb_colors = len(position.colors)
+        position.players = list(data[3:3 + nb_colors])
+        position.starts = [1 << geometry.cell(*starts[color]) for color in position.colors]
+
+        plane = (board_size ** 2 + 7) // 8
+        pieces = (len(geometry.piece_names) + 7) // 8
+        i = 3 + nb_colors
+        (occupied, low, high) = [geometry.expand(int.from_bytes(data[i + k * plane:i + (k + 1) * plane], 'little'))
+                                 for k in range(3)]
+        position.occupancies = [occupied & ~low & ~high, low & ~high, high & ~low, low & high][:nb_colors]
+        i += 3 * plane
+        position.remaining = [int.from_bytes(data[i + k * pieces:i + (k + 1) * pieces], 'little')
+                              for k in range(nb_colors)]
+        i += nb_colors * pieces
+        (position.turn, position.out, monomino, position.ply, key) = struct.unpack('<BBBHq', data[i:])
+        position.last_piece = ['1' if monomino >> k & 1 else None for k in range(nb_colors)]
+        if position.key() != key:
+            raise ValueError('corrupted position')
+        return(position)
+
+    def __reduce__(self):
+        # Pickled (e.g. to be sent to a worker process) as its snapshot
+        return(Position.from_bytes, (self.to_bytes(),))
+
+    def copy(self):
+        other = Position.__new__(Position)
+        other.__dict__.update(self.__dict__)
+        other.occupancies = list(self.occupancies)
+        other.remaining = list(self.remaining)
+        other.last_piece = list(self.last_piece)
+        return(other)
+
+    def key(self):
+        '''Hash of the position, equal for equal positions in any process.'''
+        # The last piece only matters for the bonus of the colors with an empty bag
+        bonus = sum(1 << i for i, remaining in enumerate(self.remaining)
+                    if not remaining and self.last_piece[i] == '1')
+        return(hash((tuple(self.occupancies), tuple(self.remaining), self.turn, self.out, bonus)))
+
+    @property
+    def to_play(self):
+        return(self.colors[self.turn])
+
+    def occupied(self):
+        '''All cells occupied on the board.'''
+        occupied = 0
+        for occupancy in self.occupancies:
+            occupied |= occupancy
+        return(occupied)
+
+    def forbidden(self, turn = None):
+        '''Cells where color number turn can not put a piece.'''
+        if turn is None:
+            turn = self.turn
+        return(self.occupied() | self.geometry.edge_dilate(self.occupancies[turn]))
+
+    def anchors(self, turn = None):
+        '''Cells where color number turn can put a piece touching its corners.'''
+        if turn is None:
+            turn = self.turn
+        if not self.occupancies[turn]:
+            return(self.starts[turn] & ~self.occupied())
+        return(self.geometry.diagonal_dilate(self.occupancies[turn]) & ~self.forbidden(turn))
+
+    def is_legal(self, move, turn = None):
+        '''Returns True whether the placement id move is allowed.'''
+        if turn is None:
+            turn = self.turn
+        if move == PASS:
+            return(True)
+        geometry = self.geometry
+        if not 0 <= move < len(geometry.masks):
+            return(False)
+        mask = geometry.masks[move]
+        return(bool(self.remaining[turn] >> geometry.pieces[move] & 1)
+               and not mask & self.forbidden(turn)
+               and bool(mask & self.anchors(turn)))
+
+    def legal_moves(self, turn = None):
+        '''List of placement ids allowed for color number turn.'''
+        if turn is None:
+            turn = self.turn
+        if self.out >> turn & 1:
+            return([])
+        geometry = self.geometry
+        masks = geometry.masks
+        forbidden = self.forbidden(turn)
+        pieces = list(bits(self.remaining[turn]))
+        seen = set()
+        moves = []
+        for cell in bits(self.anchors(turn)):
+            by_piece = geometry.by_cell[cell]
+            for i in pieces:
+                for pid in by_piece[i]:
+                    if not masks[pid] & forbidden and pid not in seen:
+                        seen.add(pid)
+                        moves.append(pid)
+        return(moves)
+
+    def has_legal_move(self, turn = None):
+        '''Returns True whether color number turn can put a piece.'''
+        if turn is None:
+            turn = self.turn
+        if self.out >> turn & 1:
+            return(False)
+        geometry = self.geometry
+        masks = geometry.masks
+        forbidden = self.forbidden(turn)
+        pieces = list(bits(self.remaining[turn]))
+        for cell in bits(self.anchors(turn)):
+            by_piece = geometry.by_cell[cell]
+            for i in pieces:
+                for pid in by_piece[i]:
+                    if not masks[pid] & forbidden:
+                        return(True)
+        return(False)
+
+    def iter_moves(self, turn = None, rng = None):
+        '''
+        Iterates lazily over the placement ids allowed for color number turn:
+        largest pieces first, and for each piece the corners near the center
+        first. With a random generator rng, pieces of the same size and
+        corners come in random order. Only the moves consumed are generated:
+        next(position.iter_moves(), PASS) is a good first move, and
+        itertools.islice(position.iter_moves(), k) gives k good candidates.
+        '''
+        if turn is None:
+            turn = self.turn
+        if self.out >> turn & 1:
+            return
+        geometry = self.geometry
+        masks = geometry.masks
+        forbidden = self.forbidden(turn)
+        remaining = self.remaining[turn]
+        anchors = list(bits(self.anchors(turn)))
+        if rng is None:
+            anchors.sort(key = geometry.cell_priority.__getitem__)
+            pieces = [i for i in geometry.size_order if remaining >> i & 1]
+        else:
+            rng.shuffle(anchors)
+            sizes = geometry.piece_sizes
+            pieces = [i for i in bits(remaining)]
+            rng.shuffle(pieces)
+            pieces.sort(key = lambda i: -sizes[i])
+        by_cell = geometry.by_cell
+        for i in pieces:
+            # A placement covering two anchors is met twice, only for its own piece
+            seen = set()
+            for cell in anchors:
+                for pid in by_cell[cell][i]:
+                    if not masks[pid] & forbidden and pid not in seen:
+                        seen.add(pid)
+                        yield pid
+
+    def play(self, move):
+        '''
+        Plays placement id move (or PASS) for the color to play, without
+        checking it, and gives the hand to the next color still in game.
+        A color which passes is out of the game.
+        '''
+        turn = self.turn
+        if move == PASS:
+            self.out |= 1 << turn
+        else:
+            geometry = self.geometry
+            piece = geometry.pieces[move]
+            self.occupancies[turn] |= geometry.masks[move]
+            self.remaining[turn] &= ~(1 << piece)
+            self.last_piece[turn] = geometry.piece_names[piece]
+            if not self.remaining[turn]:
+                self.out |= 1 << turn
+        self.ply += 1
+        self.next_turn()
+        return(None)
+
+    def next_turn(self):
+        '''Gives the hand to the next color still in game.'''
+        n = len(self.colors)
+        for step in range(1, n + 1):
+            turn = (self.turn + step) % n
+            if not self.out >> turn & 1:
+                self.turn = turn
+                return(None)
+        return(None)
+
+    def apply_move(self, color, piece_name, orientation, position):
+        '''Same signature as Board.apply_move, with the move checked.'''
+        if color != self.to_play:
+            raise ValueError('It is not the turn of color {}'.format(color))
+        move = self.geometry.ids.get((piece_name, orientation, tuple(position)))
+        if move is None or not self.is_legal(move):
+            raise ValueError('invalid action')
+        self.play(move)
+        return(None)
+
+    def is_end(self):
+        '''Returns True if game is over, else False.'''
+        return(self.out == (1 << len(self.colors)) - 1)
+
+    def scores(self):
+        '''
+        Score of each color with the rules of Board.scores(): minus the number
+        of cells of the remaining pieces, plus 15 when all pieces were placed
+        (20 when the last one was the monomino '1').
+        '''
+        geometry = self.geometry
+        scores = dict()
+        for turn, color in enumerate(self.colors):
+            malus = sum(geometry.piece_sizes[i] for i in bits(self.remaining[turn]))
+            scores[color] = -malus
+            if malus == 0 and self.last_piece[turn] == '1':
+                scores[color] += 20
+            elif malus == 0:
+                scores[color] += 15
+        return(scores)
+
+    def player_scores(self):
+        '''Score of each player, summed over its colors.'''
+        scores = dict()
+        for color, score in self.scores().items():
+            player = self.players[self.colors.index(color)]
+            scores[player] = scores.get(player, 0) + score
+        return(scores)
+
+    def text_repr(self):
+        '''Prints the board with one letter per color.'''
+        geometry = self.geometry
+        table = [['.'] * geometry.board_size for _ in range(geometry.board_size)]
+        for color, occupancy in zip(self.colors, self.occupancies):
+            for (x, y) in geometry.points(occupancy):
+                table[x][y] = color
+        print('\n'.join(''.join(row) for row in table))
+        return(None)
+
+# # Example
+# position = Position()
+# position.apply_move('b', 'V5', 'c', (17, 0))
+# len(position.legal_moves()) # moves of yellow
+# position.play(position.legal_moves()[0])
+# position.text_repr()
+# from itertools import islice
+# list(islice(position.iter_moves(), 10)) # 10 moves with the largest pieces
+
+def moves_between(before, after):
+    '''
+    Moves leading from position before to position after, when each color
+    played at most once in between (for example from a move of a color to its
+    next move). None if after does not follow before.
+    '''
+    geometry = before.geometry
+    position = before.copy()
+    moves = []
+    for _ in range(len(position.colors) + 1):
+        if position.key() == after.key():
+            return(moves)
+        if position.is_end():
+            return(None)
+        turn = position.turn
+        before_mask = position.occupancies[turn]
+        after_mask = after.occupancies[turn]
+        if after_mask & before_mask != before_mask:
+            return(None)
+        if after_mask != before_mask:
+            move = geometry.placement_of(after_mask & ~before_mask)
+            if move is None or not position.is_legal(move):
+                return(None)
+        elif after.out >> turn & 1:
+            move = PASS
+        else:
+            return(None)
+        position.play(move)
+        moves.append(move)
+    return(None)
+# # Example
+# before = Position()
+# after = before.copy()
+# after.play(after.legal_moves()[0])
+# after.play(after.legal_moves()[0])
+# moves_between(before, after) # the two moves
+
+################
+# Packed moves #
+################
+# In an array of moves, a move is stored as move + 1, so that PASS is 0 and
+# an array of 16 bits unsigned integers (typecode 'H') holds all the moves of
+# a board of size 20.
+def pack_moves(geometry, moves):
+    '''Array of moves stored as move + 1.'''
+    return(array(geometry.move_typecode, [move + 1 for move in moves]))
+
+def unpack_moves(packed):
+    '''List of moves of an array of pack_moves.'''
+    return([code - 1 for code in packed])
+
+def moves_to_bytes(geometry, moves):
+    '''Bytes of pack_moves (little endian), 2 bytes per move for a board of size 20.'''
+    packed = pack_moves(geometry, moves)
+    if sys.byteorder != 'little':
+        packed.byteswap()
+    return(packed.tobytes())
+
+def moves_from_bytes(geometry, data):
+    packed = array(geometry.move_typecode)
+    packed.frombytes(data)
+    if sys.byteorder != 'little':
+        packed.byteswap()
+    return(unpack_moves(packed))
+# # Example
+# geometry = get_geometry()
+# data = moves_to_bytes(geometry, [geometry.ids[('V5', 'c', (17, 0))], PASS])
+# moves_from_bytes(geometry, data)
+
+############
+# Notation #
+############
+# A move is written as 'piece orientation x y', for example 'V5 rr 5 5',
+# and a pass is written as 'pass'.
+def move_to_text(geometry, move):
+    if move == PASS:
+        return('pass')
+    piece_name, orientation, (x, y) = geometry.decode(move)
+    return('{} {} {} {}'.format(piece_name, orientation, x, y))
+
+def text_to_move(geometry, text):
+    '''Placement id of a move written as text, ValueError if unknown.'''
+    fields = text.split()
+    if fields == ['pass']:
+        return(PASS)
+    try:
+        piece_name, orientation, x, y = fields
+        return(geometry.ids[(piece_name, orientation, (int(x), int(y)))])
+    except (ValueError, KeyError):
+        raise ValueError('unknown move: {!r}'.format(text))
+# text_to_move(get_geometry(), 'V5 rr 5 5')
+# move_to_text(get_geometry(), text_to_move(get_geometry(), 'V5 rr 5 5'))
@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+from modules.engine import PASS, bits, popcount
+
+'''
+   Territory and influence features for evaluating a position.
+
+   The bit sets of the four colors are packed side by side into one integer
+   (one lane per color), so that one shift of this integer dilates the four
+   colors at once. A lane has one padding row on top of the padding column of
+   modules.engine, so that a shift never moves a cell from a lane to another.
+
+   Features of each color:
+   - reach: cells that the color could cover within depth moves, ignoring the
+     moves of the other colors,
+   - exclusive: cells of reach that no other color can reach,
+   - contested: cells of reach that at least one other color can reach,
+   - corners: cells where the color can put a piece (see Position.anchors),
+   - usable_corners: corners where at least one remaining piece fits.
+'''
+
+###############
+# Class Lanes #
+###############
+class Lanes():
+    '''Packing of one bit set per color into one integer.'''
+    def __init__(self, geometry, nb_lanes = 4):
+        self.geometry = geometry
+        self.nb_lanes = nb_lanes
+        self.width = geometry.nb_cells + geometry.stride # one padding row
+        self.lane_mask = (1 << self.width) - 1
+        self.board_mask = self.pack([geometry.board_mask] * nb_lanes)
+
+    def pack(self, masks):
+        packed = 0
+        for i, mask in enumerate(masks):
+            packed |= mask << (i * self.width)
+        return(packed)
+
+    def unpack(self, packed):
+        return([(packed >> (i * self.width)) & self.lane_mask for i in range(self.nb_lanes)])
+
+    def edge_dilate(self, packed):
+        s = self.geometry.stride
+        return(((packed << 1) | (packed >> 1) | (packed << s) | (packed >> s)) & self.board_mask)
+
+    def diagonal_dilate(self, packed):
+        s = self.geometry.stride
+        return(((packed << (s + 1)) | (packed << (s - 1)) |
+                (packed >> (s - 1)) | (packed >> (s + 1))) & self.board_mask)
+
+###################
+# Class Influence #
+###################
+class Influence():
+    '''
+    Packed forbidden cells and corners of all colors for a position.
+    Call update(move, turn) after each position.play(move) to keep it up to
+    date without recomputing it from the occupancies.
+    '''
+    def __init__(self, position, depth = 2):
+        geometry = position.geometry
+        self.geometry = geometry
+        self.depth = depth
+        self.lanes = Lanes(geometry, len(position.colors))
+        self.nb_colors = len(position.colors)
+        self.remaining = list(position.remaining)
+        occupied = position.occupied()
+        self.occupied = occupied
+        self.forbidden = self.lanes.pack([position.forbidden(turn)
+                                          for turn in range(self.nb_colors)])
+        self.anchors = self.lanes.pack([position.anchors(turn)
+                                        for turn in range(self.nb_colors)])
+
+    def copy(self):
+        other = Influence.__new__(Influence)
+        other.__dict__.update(self.__dict__)
+        other.remaining = list(self.remaining)
+        return(other)
+
+    def update(self, move, turn):
+        '''Takes into account placement id move played by color number turn.'''
+        if move == PASS:
+            return(None)
+        geometry = self.geometry
+        lanes = self.lanes
+        mask = geometry.masks[move]
+        self.occupied |= mask
+        self.remaining[turn] &= ~(1 << geometry.pieces[move])
+        shift = turn * lanes.width
+        # The piece is forbidden for everybody, its edges for its own color
+        self.forbidden |= lanes.pack([mask] * self.nb_colors)
+        self.forbidden |= geometry.edge_dilate(mask) << shift
+        # New corners of the color, and corners covered or forbidden for all
+        self.anchors |= geometry.diagonal_dilate(mask) << shift
+        self.anchors &= ~self.forbidden
+        return(None)
+
+    def reach(self, depth = None):
+        '''Packed cells reachable by each color within depth moves.'''
+        if depth is None:
+            depth = self.depth
+        lanes = self.lanes
+        free = lanes.board_mask & ~self.forbidden
+        reach = self.anchors
+        for move in range(depth):
+            if move > 0:
+                reach |= lanes.diagonal_dilate(reach) & free
+            for _ in range(self.geometry.max_rank - 1):
+                reach |= lanes.edge_dilate(reach) & free
+        return(reach)
+
+    def usable_corners(self, turn):
+        '''Number of corners of color number turn where a remaining piece fits.'''
+        geometry = self.geometry
+        masks = geometry.masks
+        forbidden = (self.forbidden >> (turn * self.lanes.width)) & self.lanes.lane_mask
+        anchors = (self.anchors >> (turn * self.lanes.width)) & self.lanes.lane_mask
+        pieces = list(bits(self.remaining[turn]))
+        count = 0
+        for cell in bits(anchors):
+            by_piece = geometry.by_cell[cell]
+            if any(not masks[pid] & forbidden for i in pieces for pid in by_piece[i]):
+                count += 1
+        return(count)
+
+    def features(self, depth = None):
+        '''Dict of features (see the module docstring) for each color number.'''
+        reach = self.lanes.unpack(self.reach(depth))
+        anchors = self.lanes.unpack(self.anchors)
+        # Cells reached by at least one color, and by at least two colors
+        one = 0
+        two = 0
+        for mask in reach:
+            two |= one & mask
+            one |= mask
+        output = []
+        for turn in range(self.nb_colors):
+            output.append({
+                'reach': popcount(reach[turn]),
+                'exclusive': popcount(reach[turn] & ~two),
+                'contested': popcount(reach[turn] & two),
+                'corners': popcount(anchors[turn]),
+                'usable_corners': self.usable_corners(turn),
+            })
+        return(output)
+
+default_weights = {'reach': 0.0, 'exclusive': 1.0, 'contested': 0.5,
+                   'corners': 0.0, 'usable_corners': 2.0, 'placed': 1.0}
+
+def evaluate(position, influence = None, weights = default_weights):
+    '''
+    Heuristic value of the position for each player: weighted sum of the
+    features of its colors minus those of the other colors. 'placed' is the
+    number of cells already covered by the color.
+    '''
+    if influence is None:
+        influence = Influence(position)
+    features = influence.features()
+    values = []
+    for turn, feature in enumerate(features):
+        feature['placed'] = popcount(position.occupancies[turn])
+        values.append(sum(weights.get(k, 0.0) * v for k, v in feature.items()))
+    output = dict()
+    for turn, player in enumerate(position.players):
+        output[player] = output.get(player, 0.0) + values[turn]
+    total = sum(output.values())
+    return({player: 2 * value - total for player, value in output.items()})
+
+# # Example
+# from modules.engine import Position
+# position = Position()
+# influence = Influence(position)
+# move = position.legal_moves()[0]
+# turn = position.turn
+# position.play(move)
+# influence.update(move, turn)
+# influence.features()
+# evaluate(position, influence)
@@ -0,0 +1,356 @@
+# -*- coding: utf-8 -*-
+from multiprocessing import Pool
+from modules.piece import BagOfPieces
+
+'''
+   Exact cover solver (Knuth's Algorithm X with dancing links) and tiling of
+   regions with pieces.
+
+   Source:
+       https://arxiv.org/abs/cs/0011047 (Dancing Links, D. E. Knuth)
+
+   An exact cover problem is a list of rows, each row being a list of
+   columns. A solution is a set of rows covering each primary column exactly
+   once and each secondary column at most once.
+
+   The matrix is stored as a circular doubly linked list in flat lists (left,
+   right, up, down, column and row of each node): node 0 is the root, nodes
+   1 to nb_columns are the headers of the columns, then come the 1 of the
+   rows. Covering a column unlinks it and all rows using it, uncovering links
+   them back in the reverse order, so backtracking never copies the matrix.
+
+   For tiling, the columns are the cells of the region and the pieces, the
+   rows are the placements (piece_name, orientation, position) of the pieces
+   inside the region, with the naming of Board.put_piece_on_board.
+
+   The search tree can be split: branches(depth) gives the partial solutions
+   with depth rows, and each of them is searched independently
+   (solve(prefix = ...)), for example by a pool of processes (solve_parallel).
+'''
+
+####################
+# Class ExactCover #
+####################
+class ExactCover():
+    '''
+    Exact cover problem with nb_primary primary columns (0 to nb_primary - 1)
+    and nb_secondary secondary columns (numbered after the primary ones).
+    '''
+    def __init__(self, rows, nb_primary, nb_secondary = 0):
+        self.rows = [list(row) for row in rows]
+        self.nb_primary = nb_primary
+        self.nb_secondary = nb_secondary
+        nb_columns = nb_primary + nb_secondary
+
+        # Root and headers
+        self.left = [0] * (nb_columns + 1)
+        self.right = [0] * (nb_columns + 1)
+        self.up = list(range(nb_columns + 1))
+        self.down = list(range(nb_columns + 1))
+        self.column = list(range(nb_columns + 1))
+        self.row = [-1] * (nb_columns + 1)
+        self.sizes = [0] * (nb_columns + 1)
+        headers = list(range(nb_primary + 1)) # only primary columns are linked to the root
+        for k, c in enumerate(headers):
+            self.left[c] = headers[k - 1]
+            self.right[c] = headers[(k + 1) % len(headers)]
+        for c in range(nb_primary + 1, nb_columns + 1):
+            self.left[c] = self.right[c] = c
+
+        # Rows
+        self.first_node = [] # first_node[r] is a node of row r
+        for r, row in enumerate(self.rows):
+            first = len(self.column)
+            for k, col in enumerate(row):
+                c = col + 1
+                node = len(self.column)
+                self.column.append(c)
+                self.row.append(r)
+                self.up.append(self.up[c])
+                self.down.append(c)
+                self.down[self.up[c]] = node
+                self.up[c] = node
+                self.sizes[c] += 1
+                self.left.append(node - 1 if k > 0 else first + len(row) - 1)
+                self.right.append(node + 1 if k < len(row) - 1 else first)
+            self.first_node.append(first)
+        self.nodes = 0
+
+    def cover(self, c):
+        (left, right, up, down) = (self.left, self.right, self.up, self.down)
+        column, sizes = self.column, self.sizes
+        right[left[c]] = right[c]
+        left[right[c]] = left[c]
+        i = down[c]
+        while i != c:
+            j = right[i]
+            while j != i:
+                down[up[j]] = down[j]
+                up[down[j]] = up[j]
+                sizes[column[j]] -= 1
+                j = right[j]
+            i = down[i]
+        return(None)
+
+    def uncover(self, c):
+        (left, right, up, down) = (self.left, self.right, self.up, self.down)
+        column, sizes = self.column, self.sizes
+        i = up[c]
+        while i != c:
+            j = left[i]
+            while j != i:
+                sizes[column[j]] += 1
+                down[up[j]] = j
+                up[down[j]] = j
+                j = left[j]
+            i = up[i]
+        right[left[c]] = c
+        left[right[c]] = c
+        return(None)
+
+    def select(self, r):
+        '''Puts row r in the solution: covers all its columns.'''
+        node = self.first_node[r]
+        self.cover(self.column[node])
+        j = self.right[node]
+        while j != node:
+            self.cover(self.column[j])
+            j = self.right[j]
+        return(None)
+
+    def deselect(self, r):
+        '''Reverse of select(r).'''
+        node = self.first_node[r]
+        j = self.left[node]
+        while j != node:
+            self.uncover(self.column[j])
+            j = self.left[j]
+        self.uncover(self.column[node])
+        return(None)
+
+    def search(self, solution, depth = None):
+        '''
+        Generates the solutions extending solution (a list of rows already
+        selected), or the partial solutions of depth rows if depth is given.
+        '''
+        (right, down, sizes) = (self.right, self.down, self.sizes)
+        if right[0] == 0:
+            yield(list(solution))
+            return
+        if depth is not None and len(solution) >= depth:
+            yield(list(solution))
+            return
+        self.nodes += 1
+
+        # Column with the fewest rows
+        c = right[0]
+        best = c
+        while c != 0:
+            if sizes[c] < sizes[best]:
+                best = c
+                if sizes[c] <= 1:
+                    break
+            c = right[c]
+        if sizes[best] == 0:
+            return
+
+        (left, column, row) = (self.left, self.column, self.row)
+        self.cover(best)
+        r = down[best]
+        try:
+            while r != best:
+                solution.append(row[r])
+                j = right[r]
+                while j != r:
+                    self.cover(column[j])
+                    j = right[j]
+                try:
+                    yield from self.search(solution, depth)
+                finally:
+                    # Also when the generator is closed before its end, so
+                    # that the matrix is always restored
+                    j = left[r]
+                    while j != r:
+                        self.uncover(column[j])
+                        j = left[j]
+                    solution.pop()
+                r = down[r]
+        finally:
+            self.uncover(best)
+        return
+
+    def solve(self, limit = None, prefix = ()):
+        '''
+        Generates the solutions (lists of row numbers), at most limit of them.
+        With a prefix of rows (for example from branches()), only the
+        solutions containing those rows are generated.
+        '''
+        for r in prefix:
+            self.select(r)
+        search = self.search(list(prefix))
+        try:
+            for k, solution in enumerate(search):
+                if limit is not None and k >= limit:
+                    break
+                yield(solution)
+        finally:
+            search.close()
+            for r in reversed(prefix):
+                self.deselect(r)
+
+    def first(self, prefix = ()):
+        '''First solution, or None.'''
+        for solution in self.solve(1, prefix):
+            return(solution)
+        return(None)
+
+    def count(self, prefix = ()):
+        return(sum(1 for _ in self.solve(prefix = prefix)))
+
+    def branches(self, depth):
+        '''Partial solutions with depth rows, splitting the search tree.'''
+        return(list(self.search([], depth)))
+
+# # Example (from the paper of Knuth)
+# rows = [[2, 4, 5], [0, 3, 6], [1, 2, 5], [0, 3], [1, 6], [3, 4, 6]]
+# problem = ExactCover(rows, 7)
+# list(problem.solve()) # [[3, 0, 4]]
+
+##############################
+# Parallel search of a cover #
+##############################
+_problem = None
+
+def _init_worker(rows, nb_primary, nb_secondary):
+    global _problem
+    _problem = ExactCover(rows, nb_primary, nb_secondary)
+
+def _solve_branch(args):
+    (prefix, first, count) = args
+    if count:
+        return(_problem.count(prefix))
+    return(list(_problem.solve(1 if first else None, prefix)))
+
+def solve_parallel(problem, first = False, processes = None, depth = 2, count = False):
+    '''
+    Solves problem with a pool of processes: the search tree is split at
+    depth rows and each branch is a task. Generates the solutions as soon as
+    their branch is finished (only one if first is True), or the number of
+    solutions of each branch if count is True.
+    '''
+    branches = problem.branches(depth)
+    initargs = (problem.rows, problem.nb_primary, problem.nb_secondary)
+    tasks = [(prefix, first, count) for prefix in branches]
+    with Pool(processes, initializer = _init_worker, initargs = initargs) as pool:
+        for result in pool.imap_unordered(_solve_branch, tasks):
+            if count:
+                yield(result)
+                continue
+            for solution in result:
+                yield(solution)
+                if first:
+                    return # leaving the with block terminates the other tasks
+
+# # Example
+# rows = [[2, 4, 5], [0, 3, 6], [1, 2, 5], [0, 3], [1, 6], [3, 4, 6]]
+# list(solve_parallel(ExactCover(rows, 7), depth = 1))
+
+##########
+# Tiling #
+##########
+def rectangle(height, width, holes = ()):
+    '''Cells (x, y) of a rectangle, without the holes.'''
+    holes = set(holes)
+    return([(x, y) for x in range(height) for y in range(width) if (x, y) not in holes])
+# # Examples
+# rectangle(6, 10)
+# rectangle(8, 8, holes = [(3, 3), (3, 4), (4, 3), (4, 4)])
+
+def pieces_of_rank(rank):
+    '''Pieces of BagOfPieces with rank cells (rank 5: the 12 pentominoes).'''
+    return([piece for piece in BagOfPieces(None, None, rank) if len(piece) == rank])
+
+################
+# Class Tiling #
+################
+class Tiling():
+    '''
+    Tiling of region (a list of cells (x, y)) with pieces (a list of Piece).
+    When the pieces have exactly as many cells as the region, each piece is
+    used once; when they have more cells, each piece is used at most once.
+
+    placements[r] is the placement (piece_name, orientation, position) of
+    row r of the exact cover problem.
+    '''
+    def __init__(self, region, pieces):
+        self.region = list(region)
+        self.pieces = list(pieces)
+        nb_cells = len(self.region)
+        total = sum(len(piece) for piece in self.pieces)
+        if total < nb_cells:
+            raise ValueError('The pieces have fewer cells than the region')
+        index = {cell: k for k, cell in enumerate(self.region)}
+
+        self.placements = []
+        rows = []
+        for i, piece in enumerate(self.pieces):
+            for orientation, form in piece.forms.items():
+                (a0, b0) = form[0]
+                for (x0, y0) in self.region:
+                    (x, y) = (x0 - a0, y0 - b0)
+                    cells = [(x + a, y + b) for (a, b) in form]
+                    if all(cell in index for cell in cells):
+                        self.placements.append((piece.name, orientation, (x, y)))
+                        rows.append([index[cell] for cell in cells] + [nb_cells + i])
+
+        if total == nb_cells:
+            self.problem = ExactCover(rows, nb_cells + len(self.pieces))
+        else:
+            self.problem = ExactCover(rows, nb_cells, len(self.pieces))
+
+    def to_placements(self, solution):
+        return([self.placements[r] for r in solution])
+
+    def solve(self, first = False, processes = 1, depth = 2):
+        '''
+        Generates the tilings, as lists of placements (only one if first is
+        True). With processes other than 1, the search is split at depth
+        placements and run by a pool of processes (None: one per cpu).
+        '''
+        if processes == 1:
+            solutions = self.problem.solve(1 if first else None)
+        else:
+            solutions = solve_parallel(self.problem, first, processes, depth)
+        for solution in solutions:
+            yield(self.to_placements(solution))
+
+    def count(self, processes = 1, depth = 2):
+        if processes == 1:
+            return(self.problem.count())
+        return(sum(solve_parallel(self.problem, processes = processes,
+                                  depth = depth, count = True)))
+
+    def text_repr(self, placements):
+        '''Region with the name of the piece covering each cell.'''
+        forms = {piece.name: piece.forms for piece in self.pieces}
+        names = dict()
+        for (piece_name, orientation, (x, y)) in placements:
+            for (a, b) in forms[piece_name][orientation]:
+                names[(x + a, y + b)] = piece_name
+        width = max(len(name) for name in names.values()) if names else 1
+        (max_x, max_y) = (max(x for x, _ in self.region), max(y for _, y in self.region))
+        (min_x, min_y) = (min(x for x, _ in self.region), min(y for _, y in self.region))
+        lines = []
+        for x in range(min_x, max_x + 1):
+            line = [names.get((x, y), '.').ljust(width) for y in range(min_y, max_y + 1)]
+            lines.append(' '.join(line).rstrip())
+        return('\n'.join(lines))
+
+# # Example: pentominoes on a 6x10 rectangle (2339 tilings up to symmetry)
+# tiling = Tiling(rectangle(6, 10), pieces_of_rank(5))
+# print(tiling.text_repr(next(tiling.solve(first = True))))
+# tiling.count(processes = None) # 9356
+#
+# # Example: pentominoes on a 8x8 square without its center
+# tiling = Tiling(rectangle(8, 8, [(3, 3), (3, 4), (4, 3), (4, 4)]), pieces_of_rank(5))
+# tiling.count(processes = None) # 520 (65 up to symmetry)
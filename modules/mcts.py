@@ -0,0 +1,322 @@
+# -*- coding: utf-8 -*-
+import math
+import random
+import threading
+import time
+from modules.engine import PASS, moves_between
+from modules.tree import Tree, NO_NODE
+from modules.ordering import widening
+
+'''
+   Monte Carlo tree search player, with its tree stored in a Tree
+   (see modules.tree).
+
+   Each simulation goes down the tree with UCT, expands the leaf with all its
+   legal moves, finishes the game with random moves, and gives a reward to
+   each color: 1 when the player of the color wins, 0.5 for a draw, 0 else.
+'''
+
+def rewards(position):
+    '''Reward of each color number at the end of the game.'''
+    scores = position.player_scores()
+    best = max(scores.values())
+    winners = [p for p, s in scores.items() if s == best]
+    output = []
+    for player in position.players:
+        if player not in winners:
+            output.append(0.0)
+        else:
+            output.append(1.0 / len(winners))
+    return(output)
+
+def random_playout(position, rng = random):
+    '''Plays random moves until the end of the game (position is modified).'''
+    while not position.is_end():
+        moves = position.legal_moves()
+        position.play(rng.choice(moves) if moves else PASS)
+    return(position)
+
+def lazy_playout(position, rng = random):
+    '''
+    Plays until the end of the game the first move of Position.iter_moves in
+    random order: a random placement of one of the largest pieces left, without
+    generating the other legal moves.
+    '''
+    while not position.is_end():
+        position.play(next(position.iter_moves(rng = rng), PASS))
+    return(position)
+
+####################
+# Class MCTSPlayer #
+####################
+class MCTSPlayer():
+    '''
+    simulations is the number of simulations for each move, and c the
+    exploration constant of UCT. Pondering stops by itself when the tree has
+    max_nodes nodes. move_cache is an optional MoveCache (modules.cache) for
+    the legal moves of the expanded nodes, and endgame an optional
+    EndgameSolver (modules.endgame) used instead of the search when few moves
+    are left.
+    ordering is an optional MoveOrdering (modules.ordering): children are
+    sorted best first with its scores as priors, and its history is updated
+    with the rewards of the simulations. With widening = (c, alpha), only the
+    first widening(visits, c, alpha) children of a node are searched
+    (progressive widening).
+    evaluator is an optional Model of modules.network, or an EvaluationQueue
+    shared by several players in threads: its evaluate_one(position, moves)
+    gives the priors of the moves and the values of the leaves instead of
+    random playouts.
+    playout is the function playing a simulation to the end (random_playout,
+    or lazy_playout which is faster and places the large pieces first).
+    With think(), the best move is stable when it has stability times more
+    visits than the second one.
+    '''
+    def __init__(self, simulations = 200, c = 1.0, seed = None, capacity = 1 << 16,
+                 max_nodes = 1 << 22, move_cache = None, endgame = None,
+                 ordering = None, widening = None, stability = 1.5, evaluator = None,
+                 playout = random_playout):
+        self.evaluator = evaluator
+        self.playout = playout
+        self.stability = stability
+        self.simulations = simulations
+        self.move_cache = move_cache
+        self.endgame = endgame
+        self.ordering = ordering
+        self.widening = widening
+        self.max_nodes = max_nodes
+        self.c = c
+        self.rng = random.Random(seed)
+        self.tree = Tree(capacity)
+        self.root_position = None # position of the root of the tree
+        self.pondering = None     # (thread, stop event) while pondering
+
+    def select(self, node):
+        '''Child of node maximizing UCT (unvisited children first).'''
+        tree = self.tree
+        visits = tree.visits
+        value_sums = tree.value_sums
+        log_n = math.log(visits[node] + 1)
+        children = tree.children(node)
+        if self.widening is not None:
+            children = children[:widening(visits[node], *self.widening)]
+        priors = tree.priors
+        rng = self.rng
+        unvisited = [child for child in children if visits[child] == 0]
+        if unvisited:
+            # Best prior first; the relative noise only breaks the ties of equal priors
+            return(max(unvisited, key = lambda child: priors[child] * (1.0 + 1e-6 * rng.random())))
+        best = None
+        best_value = -1.0
+        for child in children:
+            n = visits[child]
+            value = value_sums[child] / n + self.c * math.sqrt(log_n / n)
+            if value > best_value:
+                best, best_value = child, value
+        return(best)
+
+    def expand(self, node, position):
+        if self.move_cache is not None:
+            moves = self.move_cache.legal_moves(position)
+        else:
+            moves = position.legal_moves()
+        if not moves:
+            moves = [PASS]
+        if self.ordering is not None:
+            (moves, priors) = self.ordering.priors(position, moves)
+        else:
+            priors = [1.0 / len(moves)] * len(moves)
+        self.tree.add_children(node, moves, priors, position.turn)
+        return(None)
+
+    def expand_evaluated(self, node, position):
+        '''Expands node with the priors of the evaluator and returns its values.'''
+        if self.move_cache is not None:
+            moves = self.move_cache.legal_moves(position)
+        else:
+            moves = position.legal_moves()
+        if not moves:
+            moves = [PASS]
+        (values, priors) = self.evaluator.evaluate_one(position, moves)
+        ranked = sorted(range(len(moves)), key = lambda k: -priors[k])
+        self.tree.add_children(node, [moves[k] for k in ranked], [priors[k] for k in ranked],
+                               position.turn)
+        return(values)
+
+    def simulate(self, position):
+        '''One simulation from the root; position is the root position (copied).'''
+        tree = self.tree
+        position = position.copy()
+        node = 0
+        while tree.is_expanded(node) and not position.is_end():
+            node = self.select(node)
+            position.play(tree.moves[node])
+        if self.evaluator is not None:
+            if position.is_end():
+                values = rewards(position)
+            else:
+                values = self.expand_evaluated(node, position)
+        else:
+            if not position.is_end():
+                self.expand(node, position)
+                node = self.select(node)
+                position.play(tree.moves[node])
+            self.playout(position, self.rng)
+            values = rewards(position)
+        tree.backup(node, values)
+        if self.ordering is not None:
+            while node > 0:
+                self.ordering.update(tree.moves[node], values[tree.turns[node]])
+                node = tree.parents[node]
+        return(None)
+
+    def search(self, position, simulations = None):
+        '''Runs simulations from position on the current tree.'''
+        if simulations is None:
+            simulations = self.simulations
+        for _ in range(simulations):
+            self.simulate(position)
+        return(None)
+
+    def best_move(self):
+        '''Most visited move of the root.'''
+        tree = self.tree
+        children = tree.children(0)
+        if not children:
+            return(PASS)
+        return(tree.moves[max(children, key = lambda child: tree.visits[child])])
+
+    def is_stable(self):
+        '''True when the most visited move of the root is clearly ahead of the second one.'''
+        tree = self.tree
+        visits = sorted((tree.visits[child] for child in tree.children(0)), reverse = True)
+        if len(visits) < 2:
+            return(True)
+        return(visits[0] >= self.stability * max(visits[1], 1))
+
+    ##
+    # Tree reuse
+    ##
+    def set_root(self, position):
+        '''
+        Makes position the root of the tree. If position follows the current
+        root (for example after our move and the replies of the other colors),
+        the subtree of position is kept, else a new tree is started.
+        '''
+        if self.root_position is not None:
+            moves = moves_between(self.root_position, position)
+            if moves is not None:
+                self.advance(moves)
+                return(None)
+        self.tree.add_root()
+        self.root_position = position.copy()
+        return(None)
+
+    def advance(self, moves):
+        '''
+        Moves were played from the root position: their subtree becomes the
+        tree, all other nodes are freed at once.
+        '''
+        tree = self.tree
+        node = 0
+        for move in moves:
+            if node != NO_NODE:
+                node = tree.child(node, move)
+            self.root_position.play(move)
+        tree.promote(node)
+        return(None)
+
+    def choose_move(self, position):
+        '''Placement id (or PASS) to play for position.to_play.'''
+        self.stop_pondering()
+        if self.endgame is not None and self.endgame.applies(position):
+            solved = self.endgame.solve(position)
+            if solved is not None:
+                return(solved[1])
+        self.set_root(position)
+        simulations = max(self.simulations - self.tree.visits[0], 0)
+        if not self.tree.is_expanded(0):
+            simulations = max(simulations, 1) # an unexpanded root would pass
+        self.search(position, simulations)
+        return(self.best_move())
+
+    def think(self, position, deadline, soft_deadline = None):
+        '''
+        Anytime search: simulations from position until deadline (in
+        time.monotonic() time), or from soft_deadline on as soon as the best
+        move is stable (see modules.clock). Returns the best move so far.
+        '''
+        self.stop_pondering()
+        if self.endgame is not None and self.endgame.applies(position):
+            solved = self.endgame.solve(position, deadline)
+            if solved is not None:
+                return(solved[1])
+        self.set_root(position)
+        if soft_deadline is None:
+            soft_deadline = deadline
+        # Even after the deadline, the root is expanded so that a move can be played:
+        # an unexpanded root would pass, and a color which passes is out of the game
+        if not self.tree.is_expanded(0) and not position.is_end():
+            self.simulate(self.root_position)
+        while True:
+            now = time.monotonic()
+            if now >= deadline or (now >= soft_deadline and self.is_stable()):
+                break
+            self.simulate(self.root_position)
+        return(self.best_move())
+
+    ##
+    # Pondering
+    ##
+    def ponder(self, position):
+        '''
+        Searches position in a background thread until stop_pondering(), for
+        example while a human player is thinking.
+        '''
+        self.stop_pondering()
+        self.set_root(position)
+        stop = threading.Event()
+        root_position = self.root_position
+
+        def run():
+            while not stop.is_set() and self.tree.size < self.max_nodes:
+                self.simulate(root_position)
+
+        thread = threading.Thread(target = run, daemon = True)
+        self.pondering = (thread, stop)
+        thread.start()
+        return(None)
+
+    def stop_pondering(self, move = None):
+        '''
+        Stops pondering. If move is given, it was played on the pondered
+        position: the subtree of move becomes the new tree, so that the
+        simulations already done for the next position are kept. move is
+        ignored when the player was not pondering (its root may be older).
+        '''
+        if self.pondering is None:
+            return(None)
+        thread, stop = self.pondering
+        stop.set()
+        thread.join()
+        self.pondering = None
+        if move is not None:
+            self.advance([move])
+        return(None)
+
+# # Example
+# from modules.engine import Position
+# position = Position()
+# player = MCTSPlayer(simulations = 100)
+# move = player.choose_move(position)
+# player.tree.size, player.tree.nbytes()
+#
+# # Pondering while the opponent thinks
+# position.play(move)
+# player.ponder(position)
+# human_move = position.legal_moves()[0]  # ... some time later
+# player.stop_pondering(human_move)       # keeps the subtree of human_move
+# position.play(human_move)
+# player.choose_move(position)
+#
+# # Anytime search: best move found in half a second
+# player.think(position, time.monotonic() + 0.5)
@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+import queue
+import threading
+import numpy as np
+
+'''
+   Value and policy models on NumPy, evaluated by batches.
+
+   A position is encoded as the vector of its feature planes, seen from the
+   color to play (plane 0 is the color to play, then the next colors in turn
+   order):
+   - for each color, its occupied cells and its anchors (one plane of
+     board_size x board_size each),
+   - for each color, its remaining pieces (one value per piece).
+
+   A model maps a batch of such vectors to:
+   - a value per color (probability that the player of the color wins, as the
+     rewards of modules.mcts),
+   - a score per cell; the logit of a placement is the sum of the scores of its
+     cells plus a bias of its piece, so that the policy has board_size ** 2
+     outputs instead of one per placement.
+
+   EvaluationQueue gathers the positions sent by many threads (simulations of
+   several games, each one in its own thread), evaluates them in one batch and
+   gives each thread its result: the matrix products of NumPy are much faster
+   on a batch than on positions one by one.
+'''
+
+def placement_cells(geometry):
+    '''Array (placements x max_rank) of the cells of each placement, padded with board_size ** 2.'''
+    n = geometry.board_size
+    table = np.full((len(geometry.masks), geometry.max_rank), n * n, dtype = np.int32)
+    for pid in range(len(geometry.masks)):
+        for k, (x, y) in enumerate(geometry.points(geometry.masks[pid])):
+            table[pid, k] = x * n + y
+    return(table)
+
+def nb_features(geometry, nb_colors = 4):
+    return(nb_colors * (2 * geometry.board_size ** 2 + len(geometry.piece_names)))
+
+def encode(positions):
+    '''Array (positions x features) of float32, features seen from the color to play.'''
+    geometry = positions[0].geometry
+    n = geometry.board_size
+    nb_colors = len(positions[0].colors)
+    nb_bytes = (geometry.nb_cells + 7) // 8
+    nb_pieces = len(geometry.piece_names)
+    planes = []
+    pieces = np.zeros((len(positions), nb_colors, nb_pieces), dtype = np.float32)
+    for b, position in enumerate(positions):
+        for k in range(nb_colors):
+            turn = (position.turn + k) % nb_colors
+            planes.append(position.occupancies[turn].to_bytes(nb_bytes, 'little'))
+            planes.append(position.anchors(turn).to_bytes(nb_bytes, 'little'))
+            remaining = position.remaining[turn]
+            pieces[b, k] = [remaining >> i & 1 for i in range(nb_pieces)]
+    cells = np.unpackbits(np.frombuffer(b''.join(planes), dtype = np.uint8), bitorder = 'little')
+    cells = cells.reshape(len(planes), nb_bytes * 8)[:, :geometry.nb_cells]
+    cells = cells.reshape(len(positions), 2 * nb_colors, n, geometry.stride)[:, :, :, :n]
+    return(np.concatenate([cells.reshape(len(positions), -1).astype(np.float32),
+                           pieces.reshape(len(positions), -1)], axis = 1))
+
+###############
+# Class Model #
+###############
+class Model():
+    '''
+    Base of the models: forward(features) returns (value logits per color
+    seen from the color to play, scores per cell).
+    '''
+    def __init__(self, geometry, nb_colors = 4):
+        self.geometry = geometry
+        self.nb_colors = nb_colors
+        self.cells = placement_cells(geometry)
+        self.piece_bias = np.zeros(len(geometry.piece_names), dtype = np.float32)
+
+    def forward(self, features):
+        raise NotImplementedError
+
+    def evaluate(self, positions, moves_lists):
+        '''
+        For each position and its list of moves: (value of each color number,
+        prior of each move). PASS gets the prior of an average move.
+        '''
+        (values, scores) = self.forward(encode(positions))
+        values = 1.0 / (1.0 + np.exp(-values))
+        # Column board_size ** 2 is the padding of placement_cells
+        scores = np.concatenate([scores, np.zeros((len(positions), 1), dtype = scores.dtype)], axis = 1)
+        pieces = self.geometry.pieces
+        output = []
+        for b, (position, moves) in enumerate(zip(positions, moves_lists)):
+            ids = np.array([m for m in moves if m >= 0], dtype = np.int32)
+            logits = np.empty(len(moves), dtype = np.float64)
+            if len(ids):
+                legal = scores[b, self.cells[ids]].sum(axis = 1) + self.piece_bias[[pieces[m] for m in ids]]
+                logits[[k for k, m in enumerate(moves) if m >= 0]] = legal
+                logits[[k for k, m in enumerate(moves) if m < 0]] = legal.mean()
+            else:
+                logits[:] = 0.0
+            priors = np.exp(logits - logits.max())
+            priors /= priors.sum()
+            nb_colors = len(position.colors)
+            # Back from "seen from the color to play" to color numbers
+            value = [float(values[b, (turn - position.turn) % nb_colors]) for turn in range(nb_colors)]
+            output.append((value, priors.tolist()))
+        return(output)
+
+    def evaluate_one(self, position, moves):
+        '''evaluate for one position: (value of each color number, prior of each move).'''
+        return(self.evaluate([position], [moves])[0])
+
+    def save(self, path):
+        np.savez(path, **self.weights())
+        return(None)
+
+    def load(self, path):
+        data = np.load(path)
+        for name, value in data.items():
+            setattr(self, name, value)
+        return(self)
+
+class LinearModel(Model):
+    def __init__(self, geometry, nb_colors = 4, seed = 0, scale = 0.01):
+        Model.__init__(self, geometry, nb_colors)
+        rng = np.random.default_rng(seed)
+        f = nb_features(geometry, nb_colors)
+        self.w_value = (scale * rng.standard_normal((f, nb_colors))).astype(np.float32)
+        self.b_value = np.zeros(nb_colors, dtype = np.float32)
+        self.w_policy = (scale * rng.standard_normal((f, geometry.board_size ** 2))).astype(np.float32)
+        self.b_policy = np.zeros(geometry.board_size ** 2, dtype = np.float32)
+
+    def weights(self):
+        return({name: getattr(self, name) for name in
+                ['w_value', 'b_value', 'w_policy', 'b_policy', 'piece_bias']})
+
+    def forward(self, features):
+        return(features @ self.w_value + self.b_value,
+               features @ self.w_policy + self.b_policy)
+
+class MLPModel(Model):
+    '''Perceptron with one hidden layer of hidden units (ReLU) and the two heads.'''
+    def __init__(self, geometry, nb_colors = 4, hidden = 128, seed = 0):
+        Model.__init__(self, geometry, nb_colors)
+        rng = np.random.default_rng(seed)
+        f = nb_features(geometry, nb_colors)
+        self.w_hidden = (rng.standard_normal((f, hidden)) * np.sqrt(2.0 / f)).astype(np.float32)
+        self.b_hidden = np.zeros(hidden, dtype = np.float32)
+        self.w_value = (rng.standard_normal((hidden, nb_colors)) * np.sqrt(1.0 / hidden)).astype(np.float32)
+        self.b_value = np.zeros(nb_colors, dtype = np.float32)
+        self.w_policy = (rng.standard_normal((hidden, geometry.board_size ** 2))
+                         * np.sqrt(1.0 / hidden)).astype(np.float32)
+        self.b_policy = np.zeros(geometry.board_size ** 2, dtype = np.float32)
+
+    def weights(self):
+        return({name: getattr(self, name) for name in
+                ['w_hidden', 'b_hidden', 'w_value', 'b_value', 'w_policy', 'b_policy', 'piece_bias']})
+
+    def forward(self, features):
+        hidden = np.maximum(features @ self.w_hidden + self.b_hidden, 0.0)
+        return(hidden @ self.w_value + self.b_value,
+               hidden @ self.w_policy + self.b_policy)
+
+# # Example
+# from modules.engine import Position
+# position = Position()
+# model = MLPModel(position.geometry)
+# [(values, priors)] = model.evaluate([position], [position.legal_moves()])
+# (values, priors) = model.evaluate_one(position, position.legal_moves())
+# MCTSPlayer(simulations = 100, evaluator = model).choose_move(position)
+
+#########################
+# Class EvaluationQueue #
+#########################
+class EvaluationQueue():
+    '''
+    Evaluates with model the positions sent by several threads, by batches of
+    at most batch_size positions. A batch is evaluated as soon as it is full,
+    or when max_wait seconds passed since its first position.
+    '''
+    def __init__(self, model, batch_size = 32, max_wait = 0.002):
+        self.model = model
+        self.batch_size = batch_size
+        self.max_wait = max_wait
+        self.requests = queue.Queue()
+        self.nb_batches = 0
+        self.nb_positions = 0
+        self.thread = threading.Thread(target = self.run, daemon = True)
+        self.thread.start()
+
+    def evaluate_one(self, position, moves):
+        '''(value of each color number, prior of each move), waiting for the batch.'''
+        request = [position, moves, threading.Event(), None]
+        self.requests.put(request)
+        request[2].wait()
+        if isinstance(request[3], Exception):
+            raise request[3]
+        return(request[3])
+
+    def run(self):
+        while True:
+            first = self.requests.get()
+            if first is None:
+                return(None)
+            batch = [first]
+            try:
+                while len(batch) < self.batch_size:
+                    request = self.requests.get(timeout = self.max_wait)
+                    if request is None:
+                        self.requests.put(None) # stops after this batch
+                        break
+                    batch.append(request)
+            except queue.Empty:
+                pass
+            try:
+                results = self.model.evaluate([r[0] for r in batch], [r[1] for r in batch])
+            except Exception as e:
+                results = [e] * len(batch)
+            self.nb_batches += 1
+            self.nb_positions += len(batch)
+            for request, result in zip(batch, results):
+                request[3] = result
+                request[2].set()
+
+    def close(self):
+        self.requests.put(None)
+        self.thread.join()
+        return(None)
+
+    def mean_batch_size(self):
+        return(self.nb_positions / self.nb_batches if self.nb_batches else 0.0)
+
+# # Example: 16 games in threads sharing one queue
+# from modules.engine import Position
+# from modules.mcts import MCTSPlayer
+# evaluations = EvaluationQueue(MLPModel(Position().geometry))
+# def play():
+#     position = Position()
+#     player = MCTSPlayer(simulations = 100, evaluator = evaluations)
+#     while not position.is_end():
+#         position.play(player.choose_move(position))
+# threads = [threading.Thread(target = play) for _ in range(16)]
+# [t.start() for t in threads]
+# [t.join() for t in threads]
+# evaluations.mean_batch_size()
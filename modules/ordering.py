@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+import math
+from array import array
+from modules.engine import popcount
+
+'''
+   Move ordering for the searches.
+
+   Early in the game a color has hundreds of legal placements, most of them
+   poor. Moves are ranked by a score summing:
+   - a prior on the size of the piece: large pieces first (the 5 cells pieces
+     of BagOfPieces are hard to place late in the game),
+   - the history heuristic: a table indexed by placement id (a butterfly
+     table, since a placement id gives both the piece and its cells) which
+     accumulates the success of the move in previous searches, whatever the
+     position was,
+   - the corner gain: number of new corners opened by the placement for its
+     color, minus the corners it uses or blocks.
+
+   The searches use the ranking to try the best moves first (alpha-beta of
+   modules.endgame) or to widen the tree progressively (modules.mcts).
+'''
+
+######################
+# Class MoveOrdering #
+######################
+class MoveOrdering():
+    def __init__(self, geometry, size_weight = 1.0, history_weight = 2.0, corner_weight = 0.5):
+        self.geometry = geometry
+        self.size_weight = size_weight
+        self.history_weight = history_weight
+        self.corner_weight = corner_weight
+        self.history = array('d', [0.0]) * len(geometry.masks)
+        self.history_max = 0.0
+
+    def update(self, move, bonus):
+        '''Adds bonus to the history of placement id move.'''
+        if move < 0:
+            return(None)
+        self.history[move] += bonus
+        if self.history[move] > self.history_max:
+            self.history_max = self.history[move]
+        return(None)
+
+    def age(self, factor = 0.5):
+        '''Scales the history down, so that recent searches weigh more.'''
+        history = self.history
+        for move in range(len(history)):
+            history[move] *= factor
+        self.history_max *= factor
+        return(None)
+
+    def corner_gain(self, position, move, turn = None):
+        '''New corners of the color opened by the placement, minus its corners used or blocked.'''
+        if turn is None:
+            turn = position.turn
+        return(self._corner_gain(self.geometry.masks[move], position.anchors(turn),
+                                 position.occupied(), position.occupancies[turn]))
+
+    def _corner_gain(self, mask, anchors, occupied, occupancy):
+        geometry = self.geometry
+        blocked = occupied | mask | geometry.edge_dilate(occupancy | mask)
+        new = geometry.diagonal_dilate(mask) & ~blocked & ~anchors
+        return(popcount(new) - popcount(anchors & blocked))
+
+    def scores(self, position, moves, turn = None):
+        '''Score of each move (PASS has the lowest score).'''
+        if turn is None:
+            turn = position.turn
+        geometry = self.geometry
+        (sizes, pieces, masks) = (geometry.piece_sizes, geometry.pieces, geometry.masks)
+        history = self.history
+        scale = self.history_weight / self.history_max if self.history_max > 0 else 0.0
+        (anchors, occupied, occupancy) = (position.anchors(turn), position.occupied(),
+                                          position.occupancies[turn])
+        output = []
+        for move in moves:
+            if move < 0:
+                output.append(-1e9)
+                continue
+            score = self.size_weight * sizes[pieces[move]] + scale * history[move]
+            if self.corner_weight:
+                score += self.corner_weight * self._corner_gain(masks[move], anchors, occupied, occupancy)
+            output.append(score)
+        return(output)
+
+    def order(self, position, moves, turn = None):
+        '''Moves sorted from the best to the worst.'''
+        scores = self.scores(position, moves, turn)
+        ranked = sorted(range(len(moves)), key = lambda k: -scores[k])
+        return([moves[k] for k in ranked])
+
+    def priors(self, position, moves, temperature = 1.0, turn = None):
+        '''(moves sorted best first, softmax of their scores) for the priors of a tree.'''
+        scores = self.scores(position, moves, turn)
+        ranked = sorted(range(len(moves)), key = lambda k: -scores[k])
+        best = scores[ranked[0]] if ranked else 0.0
+        weights = [math.exp((scores[k] - best) / temperature) for k in ranked]
+        total = sum(weights)
+        return([moves[k] for k in ranked], [w / total for w in weights])
+
+def widening(visits, c = 2.0, alpha = 0.5):
+    '''Number of children of a node open to the search after visits simulations.'''
+    return(int(c * (visits + 1) ** alpha) + 1)
+
+# # Example
+# from modules.engine import Position
+# position = Position()
+# ordering = MoveOrdering(position.geometry)
+# moves = ordering.order(position, position.legal_moves())
+# [position.geometry.placements[m] for m in moves[:5]]
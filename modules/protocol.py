@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+import subprocess
+import sys
+from modules.engine import Position, PASS, get_geometry, move_to_text, text_to_move
+
+'''
+   Line based protocol between a host and a bot running as a long lived
+   subprocess (in the spirit of UCI for chess or GTP for go).
+
+   The bot is launched once, builds its geometry tables once, and then answers
+   requests on stdin/stdout. Positions are given as lists of moves from the
+   start of the game and are kept by the bot under a key, so that the host
+   only sends the new moves of a game at each request. One 'go' request can
+   ask moves for several positions.
+
+   A move is written as one token 'piece:orientation:x:y', which is the
+   notation of modules.engine with ':' instead of spaces, for example
+   'V5:rr:5:5' for ('V5', 'rr', (5, 5)), and 'pass'.
+
+   Host -> bot:
+       blokai                        bot answers 'id <name>' then 'blokaiok'
+       newgame <board_size> <max_rank> <players>   e.g. 'newgame 20 5 0,1,0,1'
+       position <key> <moves>        position key is the start plus moves
+       play <key> <moves>            moves appended to position key
+       forget <key>                  position key is not needed anymore
+       go <ms> <keys>                one answer per key: 'bestmove <key> <move>'
+                                     or 'error go <key> <message>'
+       quit
+   Bot -> host:
+       error <command> <message>     answer to a request which failed
+'''
+
+def move_to_token(geometry, move):
+    return(move_to_text(geometry, move).replace(' ', ':'))
+
+def token_to_move(geometry, token):
+    return(text_to_move(geometry, token.replace(':', ' ')))
+# move_to_token(get_geometry(), token_to_move(get_geometry(), 'V5:rr:5:5'))
+
+#######
+# Bot #
+#######
+def run_engine(choose_move, name = 'bot', stdin = None, stdout = None):
+    '''
+    Runs the bot side of the protocol until 'quit' or the end of stdin.
+    choose_move(position, ms) returns a placement id (or PASS) for
+    position.to_play, ms being the time limit of the move in milliseconds.
+    '''
+    stdin = stdin or sys.stdin
+    stdout = stdout or sys.stdout
+    geometry = get_geometry()
+    players = (0, 1, 0, 1)
+    positions = dict()
+
+    def answer(line):
+        stdout.write(line + '\n')
+        stdout.flush()
+
+    for line in stdin:
+        fields = line.split()
+        if not fields:
+            continue
+        command, args = fields[0], fields[1:]
+        try:
+            if command == 'blokai':
+                answer('id {}'.format(name))
+                answer('blokaiok')
+            elif command == 'newgame':
+                geometry = get_geometry(int(args[0]), int(args[1]))
+                players = tuple(int(p) for p in args[2].split(','))
+                positions = dict()
+            elif command == 'position' or command == 'play':
+                if command == 'position' or args[0] not in positions:
+                    positions[args[0]] = Position(geometry, players)
+                position = positions[args[0]]
+                for token in args[1:]:
+                    position.play(token_to_move(geometry, token))
+            elif command == 'forget':
+                positions.pop(args[0], None)
+            elif command == 'go':
+                ms = int(args[0])
+                for key in args[1:]:
+                    # one answer per key, so that the host knows when all are read
+                    try:
+                        move = choose_move(positions[key], ms)
+                        answer('bestmove {} {}'.format(key, move_to_token(geometry, move)))
+                    except (ValueError, KeyError, IndexError) as e:
+                        answer('error go {} {}'.format(key, e))
+            elif command == 'quit':
+                break
+            else:
+                answer('error unknown command {}'.format(command))
+        except (ValueError, KeyError, IndexError) as e:
+            answer('error {} {}'.format(command, e))
+    return(None)
+
+#######################
+# Class EngineProcess #
+#######################
+class EngineProcess():
+    '''
+    Host side of the protocol: a bot launched once as a subprocess.
+    The moves of each game already sent to the bot are remembered, so that
+    only new moves are sent at the next request.
+    '''
+    def __init__(self, command, board_size = 20, max_rank = 5, players = (0, 1, 0, 1)):
+        self.geometry = get_geometry(board_size, max_rank)
+        self.process = subprocess.Popen(command, stdin = subprocess.PIPE,
+                                        stdout = subprocess.PIPE,
+                                        universal_newlines = True, bufsize = 1)
+        self.sent = dict() # key -> moves already sent to the bot
+        self.send('blokai')
+        self.name = None
+        for line in self.lines():
+            if line.startswith('id '):
+                self.name = line[3:]
+            elif line == 'blokaiok':
+                break
+        self.send('newgame {} {} {}'.format(board_size, max_rank,
+                                           ','.join(str(p) for p in players)))
+
+    def send(self, line):
+        self.process.stdin.write(line + '\n')
+        self.process.stdin.flush()
+        return(None)
+
+    def lines(self):
+        for line in self.process.stdout:
+            yield line.rstrip('\n')
+
+    def readline(self):
+        line = self.process.stdout.readline()
+        if not line:
+            raise EOFError('bot {} stopped'.format(self.name))
+        return(line.rstrip('\n'))
+
+    def update(self, key, moves):
+        '''Sends the moves of game key which the bot does not know yet.'''
+        sent = self.sent.get(key)
+        tokens = lambda ms: ' '.join(move_to_token(self.geometry, m) for m in ms)
+        if sent is not None and moves[:len(sent)] == sent:
+            if len(moves) > len(sent):
+                self.send('play {} {}'.format(key, tokens(moves[len(sent):])))
+        else:
+            self.send('position {} {}'.format(key, tokens(moves)))
+        self.sent[key] = list(moves)
+        return(None)
+
+    def choose_moves(self, games, ms = 1000):
+        '''
+        Best move of the bot for several games at once.
+        games is a dict key -> list of placement ids from the start of the game.
+        Returns a dict key -> placement id. Raises ValueError if the bot
+        reported an error, after reading all the answers of the request.
+        '''
+        for key, moves in games.items():
+            self.update(str(key), moves)
+        self.send('go {} {}'.format(int(ms), ' '.join(str(key) for key in games)))
+        keys = {str(key): key for key in games}
+        output = dict()
+        errors = []
+        answers = 0
+        while answers < len(games):
+            fields = self.readline().split()
+            if fields[0] == 'bestmove':
+                output[keys[fields[1]]] = token_to_move(self.geometry, fields[2])
+                answers += 1
+            elif fields[0] == 'error':
+                errors.append(' '.join(fields[1:]))
+                if fields[1:2] == ['go']:
+                    answers += 1
+        if errors:
+            # The positions of the bot may differ from ours: they are sent again in full
+            for key in keys:
+                self.sent.pop(key, None)
+            raise ValueError('; '.join(errors))
+        return(output)
+
+    def choose_move(self, key, moves, ms = 1000):
+        return(self.choose_moves({key: moves}, ms)[key])
+
+    def forget(self, key):
+        if self.sent.pop(str(key), None) is not None:
+            self.send('forget {}'.format(key))
+        return(None)
+
+    def close(self):
+        if self.process.poll() is None:
+            self.send('quit')
+            self.process.wait()
+        return(None)
+
+# # Example: the random bot of this module as a subprocess
+# bot = EngineProcess([sys.executable, '-m', 'modules.protocol'])
+# position = Position()
+# moves = []
+# while not position.is_end():
+#     move = bot.choose_move('game', moves)
+#     position.play(move)
+#     moves.append(move)
+# bot.close()
+
+if __name__ == '__main__':
+    import random
+
+    def random_move(position, ms):
+        moves = position.legal_moves()
+        return(random.choice(moves) if moves else PASS)
+    run_engine(random_move, 'random')
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+import base64
+import json
+from modules.engine import (Position, get_geometry, move_to_text, text_to_move,
+                            moves_from_bytes, moves_to_bytes)
+
+'''
+   Game records.
+
+   A finished game is stored as one line of JSON (one game per line), so that
+   a file of records can be written while games are played and read back one
+   game at a time:
+       {"id": "12", "board_size": 20, "max_rank": 5, "players": [0, 1, 0, 1],
+        "names": ["bot A", "bot B"], "moves": ["V5 c 17 0", ..., "pass"],
+        "scores": {"b": -3, ...}, "player_scores": {"0": -10, "1": -7}}
+   Moves are written with the notation of modules.engine ('pass' included),
+   in the order they were played.
+
+   Packed records replace "moves" by "packed_moves": the moves packed by
+   modules.engine.moves_to_bytes (2 bytes per move on a board of size 20),
+   in base 64. They are several times smaller and faster to read, for the
+   large files of self-play.
+'''
+
+def game_record(position, moves, names = None, packed = False, **extra):
+    '''Record of a game from its final position and its list of placement ids.'''
+    geometry = position.geometry
+    record = {
+        'board_size': geometry.board_size,
+        'max_rank': geometry.max_rank,
+        'players': list(position.players),
+        'names': list(names) if names is not None else None,
+        'scores': position.scores(),
+        'player_scores': {str(k): v for k, v in position.player_scores().items()},
+    }
+    if packed:
+        record['packed_moves'] = base64.b64encode(moves_to_bytes(geometry, moves)).decode('ascii')
+    else:
+        record['moves'] = [move_to_text(geometry, move) for move in moves]
+    record.update(extra)
+    return(record)
+
+def record_moves(record, geometry = None):
+    '''List of placement ids of a record, packed or not.'''
+    if geometry is None:
+        geometry = get_geometry(record['board_size'], record['max_rank'])
+    if 'packed_moves' in record:
+        return(moves_from_bytes(geometry, base64.b64decode(record['packed_moves'])))
+    return([text_to_move(geometry, text) for text in record['moves']])
+
+def write_record(f, record):
+    '''Appends a record to an opened text file, flushed at once.'''
+    f.write(json.dumps(record, separators = (',', ':')) + '\n')
+    f.flush()
+    return(None)
+
+def read_records(path):
+    '''Iterates over the records of a file, one game at a time.'''
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+def replay(record, check = True):
+    '''
+    Replays the moves of a record and returns the list of positions before each
+    move followed by the final position. ValueError on an illegal move when
+    check is True.
+    '''
+    geometry = get_geometry(record['board_size'], record['max_rank'])
+    position = Position(geometry, record['players'])
+    positions = [position.copy()]
+    for ply, move in enumerate(record_moves(record, geometry)):
+        if check and not position.is_legal(move):
+            text = move_to_text(geometry, move) if move < len(geometry.masks) else move
+            raise ValueError('illegal move {!r} at ply {}'.format(text, ply))
+        position.play(move)
+        positions.append(position.copy())
+    return(positions)
+# # Example
+# for record in read_records('games.jsonl'):
+#     final = replay(record)[-1]
+#     final.text_repr()
@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+import struct
+import zlib
+import numpy as np
+from modules.records import replay
+
+'''
+   Headless rendering of boards into NumPy RGB images.
+
+   Board.show() builds a matplotlib figure at each call. Here nothing is
+   drawn cell by cell: the renderer precomputes, for each pixel of the image,
+   the cell of the board it belongs to (or the grid), and an image is a single
+   lookup of the colors of the cells in this table. Images are written as PNG
+   files with zlib only.
+
+   Replay of a game: a frame is the previous frame where only the cells of the
+   last placement are painted, so each frame costs a few slices of the buffer.
+
+   Rows of the images are the x coordinates of the board, columns the y
+   coordinates, as in Board.show().
+'''
+
+# Colors of Board.show() (matplotlib named colors)
+EMPTY = (255, 255, 255)
+PALETTE = {'b': (0, 0, 255), 'y': (255, 255, 0), 'r': (255, 0, 0), 'g': (0, 128, 0)}
+GRID = (0, 0, 0)
+BACKGROUND = (255, 255, 255)
+
+def color_grid(position):
+    '''Array board_size x board_size: 0 for an empty cell, k + 1 for color number k.'''
+    geometry = position.geometry
+    n = geometry.board_size
+    nb_bytes = (geometry.nb_cells + 7) // 8
+    grid = np.zeros((n, n), dtype = np.uint8)
+    for k, occupancy in enumerate(position.occupancies):
+        bits = np.unpackbits(np.frombuffer(occupancy.to_bytes(nb_bytes, 'little'), dtype = np.uint8),
+                             bitorder = 'little')[:geometry.nb_cells]
+        grid[bits.reshape(n, geometry.stride)[:, :n] == 1] = k + 1
+    return(grid)
+
+##################
+# Class Renderer #
+##################
+class Renderer():
+    '''
+    Renders boards of board_size cells with cells of cell_size pixels,
+    separated by grid lines of grid pixels.
+    '''
+    def __init__(self, board_size = 20, cell_size = 12, grid = 1, colors = None):
+        self.board_size = board_size
+        self.cell_size = cell_size
+        self.grid = grid
+        colors = colors or [PALETTE[c] for c in ['b', 'y', 'r', 'g']]
+        # palette[0] is an empty cell, palette[k + 1] color k, palette[-1] the grid
+        self.palette = np.array([EMPTY] + list(colors) + [GRID], dtype = np.uint8)
+
+        step = cell_size + grid
+        self.size = board_size * step + grid
+        # Cell of each row (or column) of pixels, -1 on the grid lines
+        line = np.full(self.size, -1, dtype = np.int32)
+        for i in range(board_size):
+            line[grid + i * step:grid + i * step + cell_size] = i
+        self.line = line
+        on_grid = (line[:, None] < 0) | (line[None, :] < 0)
+        # Index of each pixel in the flat array of cells, the grid being the last one
+        self.pixels = np.where(on_grid, board_size * board_size,
+                               line[:, None] * board_size + line[None, :])
+
+    def render_grid(self, grid, out = None):
+        '''Image (size x size x 3, uint8) of an array of color numbers (see color_grid).'''
+        cells = np.append(grid.ravel(), len(self.palette) - 1)
+        if out is None:
+            return(self.palette[cells[self.pixels]])
+        np.take(self.palette, cells[self.pixels], axis = 0, out = out)
+        return(out)
+
+    def render(self, position, out = None):
+        '''Image of a Position of modules.engine.'''
+        return(self.render_grid(color_grid(position), out))
+
+    def render_board(self, board, out = None):
+        '''Image of a Board of modules.board_20180910.'''
+        return(self.render(board.position, out))
+
+    def paint(self, image, points, color_number):
+        '''Paints cells (x, y) of an image in place with color number color_number.'''
+        step = self.cell_size + self.grid
+        rgb = self.palette[color_number + 1]
+        for (x, y) in points:
+            i = self.grid + x * step
+            j = self.grid + y * step
+            image[i:i + self.cell_size, j:j + self.cell_size] = rgb
+        return(image)
+
+    def frames(self, positions):
+        '''
+        Images of a game, given as a list of positions (see replay in
+        modules.records): each frame updates the previous one in place with
+        the cells of the last move, so the same buffer is yielded each time
+        (copy it to keep it).
+        '''
+        image = self.render(positions[0])
+        yield(image)
+        for before, after in zip(positions[:-1], positions[1:]):
+            geometry = after.geometry
+            for k in range(len(after.occupancies)):
+                new = after.occupancies[k] & ~before.occupancies[k]
+                if new:
+                    self.paint(image, geometry.points(new), k)
+            yield(image)
+
+    def replay_frames(self, record):
+        '''Frames of a game record (see modules.records).'''
+        return(self.frames(replay(record, check = False)))
+
+# # Example
+# import random
+# from modules.engine import Position, PASS
+# position = Position()
+# renderer = Renderer(position.geometry.board_size)
+# for _ in range(30):
+#     moves = position.legal_moves()
+#     position.play(random.choice(moves) if moves else PASS)
+# save_png(renderer.render(position), 'position.png')
+
+###############
+# Image files #
+###############
+def save_png(image, path):
+    '''Writes an RGB image (height x width x 3, uint8) as a PNG file.'''
+    image = np.ascontiguousarray(image, dtype = np.uint8)
+    (height, width, _) = image.shape
+    # Each row starts with its filter type (0: none)
+    rows = np.zeros((height, 1 + 3 * width), dtype = np.uint8)
+    rows[:, 1:] = image.reshape(height, 3 * width)
+
+    def chunk(kind, data):
+        return(struct.pack('>I', len(data)) + kind + data +
+               struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff))
+
+    with open(path, 'wb') as f:
+        f.write(b'\x89PNG\r\n\x1a\n')
+        f.write(chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)))
+        f.write(chunk(b'IDAT', zlib.compress(rows.tobytes(), 6)))
+        f.write(chunk(b'IEND', b''))
+    return(None)
+
+def contact_sheet(images, columns = 8, margin = 4):
+    '''Images of the same size side by side, columns images per row.'''
+    images = list(images)
+    (height, width, _) = images[0].shape
+    rows = (len(images) + columns - 1) // columns
+    sheet = np.empty((rows * (height + margin) + margin, columns * (width + margin) + margin, 3),
+                     dtype = np.uint8)
+    sheet[:] = BACKGROUND
+    for k, image in enumerate(images):
+        (i, j) = divmod(k, columns)
+        top = margin + i * (height + margin)
+        left = margin + j * (width + margin)
+        sheet[top:top + height, left:left + width] = image
+    return(sheet)
+
+def save_contact_sheet(positions, path, columns = 8, cell_size = 8):
+    '''Renders many positions into one PNG file.'''
+    positions = list(positions)
+    renderer = Renderer(positions[0].geometry.board_size, cell_size)
+    save_png(contact_sheet([renderer.render(p) for p in positions], columns), path)
+    return(None)
+
+def save_replay(record, path, columns = 10, cell_size = 6, every = 1):
+    '''Contact sheet of the game of a record, one frame every every plies.'''
+    renderer = Renderer(record['board_size'], cell_size)
+    frames = [frame.copy() for k, frame in enumerate(renderer.replay_frames(record))
+              if k % every == 0]
+    save_png(contact_sheet(frames, columns), path)
+    return(None)
+
+# # Example: all positions of the games of a file of records
+# from modules.records import read_records
+# positions = [replay(record)[-1] for record in read_records('games.jsonl')]
+# save_contact_sheet(positions, 'games.png')
+# save_replay(next(read_records('games.jsonl')), 'game.png', every = 4)
@@ -0,0 +1,338 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import collections
+import json
+import os
+import socket
+import time
+from modules.engine import Position, get_geometry
+from modules.records import game_record
+from modules.tournament import make_player
+
+'''
+   Self-play on several machines: a coordinator and any number of workers.
+
+   The coordinator splits the games into batches and hands them out to the
+   workers which connect to it (TCP or Unix socket). A worker plays the games
+   of its batch, sends back their records, and asks for another batch. The
+   coordinator appends the records to its file of records (see
+   modules.records) and acknowledges the batch.
+
+   Workers can join or leave at any time:
+   - a batch is leased to a worker for lease_time seconds; when the worker
+     disconnects or the lease expires, the batch is handed out again,
+   - a worker keeps the records of its batch until they are acknowledged,
+     and sends them again after a reconnection.
+   A batch can then be played or sent twice (at least once delivery), but the
+   coordinator writes the records of a game only once. The batches whose
+   records are all in the file are done when the coordinator is restarted;
+   the missing games of a batch cut by a crash are played again.
+
+   Back-pressure: a worker asks for a batch only when it has finished the
+   previous one, and the coordinator leases at most max_leased batches at a
+   time, answering 'wait' to the other workers.
+
+   Messages are lines of text.
+   Worker -> coordinator:
+       hello <name>               first message of the worker
+       request                    asks for a batch
+       result <batch> <records>   records of the games of a batch (JSON list)
+   Coordinator -> worker:
+       batch <batch> <task>       task is a JSON dict (config, seeds, rules)
+       wait <seconds>             no batch for now, ask again later
+       ack <batch>                records of the batch are written
+       finished                   all batches are done
+       error <reason>             line refused (too long or malformed)
+
+   A result line can be long (the records of a whole batch): the coordinator
+   reads lines of up to line_limit bytes. A worker whose result is refused
+   stops instead of sending it again.
+'''
+
+#####################
+# Class Coordinator #
+#####################
+class Coordinator():
+    '''
+    Self-play of nb_batches batches of batch_size games between bots of the
+    same config (kind, parameters), see modules.tournament.
+    '''
+    def __init__(self, config, record_path = 'selfplay.jsonl', nb_batches = 100,
+                 batch_size = 8, lease_time = 600.0, max_leased = None, seed = 0,
+                 board_size = 20, max_rank = 5, players = (0, 1, 0, 1),
+                 line_limit = 2 ** 28):
+        self.config = config
+        self.nb_batches = nb_batches
+        self.batch_size = batch_size
+        self.lease_time = lease_time
+        self.max_leased = max_leased
+        self.seed = seed
+        self.line_limit = line_limit
+        self.rules = {'board_size': board_size, 'max_rank': max_rank, 'players': list(players)}
+
+        # A batch is done when the records of all its games are in the file:
+        # after a crash while writing a batch, its missing games are played again
+        self.written = collections.defaultdict(set) # batch -> seeds of the written records
+        line = '\n'
+        if os.path.exists(record_path):
+            with open(record_path) as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                        self.written[record['batch']].add(record['seed'])
+                    except (ValueError, KeyError):
+                        pass # line cut by an interruption
+        self.done = set(batch for batch, seeds in self.written.items() if len(seeds) >= batch_size)
+        self.record_file = open(record_path, 'a')
+        if not line.endswith('\n'):
+            self.record_file.write('\n') # the records do not follow a cut line
+        self.pending = collections.deque(b for b in range(nb_batches) if b not in self.done)
+        self.leases = dict() # batch -> (connection number, deadline)
+        self.connections = 0
+        self.workers = dict() # connection number -> name of the connected workers
+        self.finished = None
+
+    async def start(self, host = '127.0.0.1', port = 0, path = None):
+        '''Listens on a Unix socket if path is given, else on TCP.'''
+        self.finished = asyncio.get_running_loop().create_future()
+        if len(self.done) == self.nb_batches:
+            self.finished.set_result(None)
+        if path is not None:
+            self.server = await asyncio.start_unix_server(self.handle, path = path,
+                                                          limit = self.line_limit)
+        else:
+            self.server = await asyncio.start_server(self.handle, host, port,
+                                                     limit = self.line_limit)
+        return(self.server)
+
+    async def close(self, grace_time = 5.0):
+        '''
+        Stops listening, then leaves grace_time seconds to the connected
+        workers to ask for a batch and be told that all batches are done.
+        '''
+        self.server.close()
+        deadline = time.monotonic() + grace_time
+        while self.workers and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        await self.server.wait_closed()
+        self.record_file.close()
+        return(None)
+
+    def task(self, batch):
+        seeds = [self.seed + batch * self.batch_size + k for k in range(self.batch_size)]
+        task = {'config': self.config, 'seeds': seeds}
+        task.update(self.rules)
+        return(task)
+
+    def expire_leases(self):
+        now = time.monotonic()
+        for batch, (_, deadline) in list(self.leases.items()):
+            if deadline < now:
+                del self.leases[batch]
+                self.pending.append(batch)
+        return(None)
+
+    def release(self, connection):
+        '''Batches of a disconnected worker are handed out again.'''
+        for batch, (owner, _) in list(self.leases.items()):
+            if owner == connection:
+                del self.leases[batch]
+                self.pending.appendleft(batch)
+        return(None)
+
+    def answer_request(self, connection):
+        if len(self.done) == self.nb_batches:
+            return('finished')
+        self.expire_leases()
+        if not self.pending or (self.max_leased is not None and len(self.leases) >= self.max_leased):
+            return('wait 1')
+        batch = self.pending.popleft()
+        self.leases[batch] = (connection, time.monotonic() + self.lease_time)
+        return('batch {} {}'.format(batch, json.dumps(self.task(batch), separators = (',', ':'))))
+
+    def receive(self, batch, records):
+        '''Writes the records of a batch, unless they were already received.'''
+        if batch in self.done or not 0 <= batch < self.nb_batches:
+            return(None)
+        written = self.written[batch]
+        lines = []
+        for record in records:
+            if record['seed'] in written:
+                continue # written before a crash of the coordinator
+            record['batch'] = batch
+            lines.append(json.dumps(record, separators = (',', ':')) + '\n')
+            written.add(record['seed'])
+        # One write for the batch, so that a crash rarely cuts it
+        self.record_file.write(''.join(lines))
+        self.record_file.flush()
+        self.done.add(batch)
+        self.leases.pop(batch, None)
+        if batch in self.pending:
+            self.pending.remove(batch)
+        if len(self.done) == self.nb_batches and not self.finished.done():
+            self.finished.set_result(None)
+        return(None)
+
+    async def handle(self, reader, writer):
+        '''Connection of one worker.'''
+        line = (await reader.readline()).decode().split()
+        if len(line) < 1 or line[0] != 'hello':
+            writer.close()
+            return(None)
+        self.connections += 1
+        connection = self.connections
+        self.workers[connection] = ' '.join(line[1:]) or 'worker'
+        try:
+            while True:
+                try:
+                    line = (await reader.readline()).decode()
+                except ValueError:
+                    # longer than line_limit: the rest of the stream is out of step
+                    writer.write(b'error line too long\n')
+                    await writer.drain()
+                    break
+                if not line:
+                    break
+                fields = line.split(' ', 2)
+                if fields[0].strip() == 'request':
+                    writer.write((self.answer_request(connection) + '\n').encode())
+                elif fields[0] == 'result':
+                    try:
+                        batch = int(fields[1])
+                        records = json.loads(fields[2])
+                    except (IndexError, ValueError):
+                        writer.write(b'error malformed result\n')
+                    else:
+                        self.receive(batch, records)
+                        writer.write('ack {}\n'.format(batch).encode())
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            self.release(connection)
+            del self.workers[connection]
+            writer.close()
+        return(None)
+
+###########
+# Workers #
+###########
+def play_batch(task):
+    '''Records of the self-play games of task (see Coordinator.task).'''
+    geometry = get_geometry(task['board_size'], task['max_rank'])
+    records = []
+    for seed in task['seeds']:
+        position = Position(geometry, task['players'])
+        bots = [make_player(task['config'], seed * 4 + k)
+                for k in range(len(set(task['players'])))]
+        moves = []
+        while not position.is_end():
+            move = bots[position.players[position.turn]].choose_move(position)
+            moves.append(move)
+            position.play(move)
+        records.append(game_record(position, moves, seed = seed))
+    return(records)
+
+def run_worker(name = 'worker', host = '127.0.0.1', port = None, path = None,
+               max_batches = None, retry_time = 1.0, max_retries = 30):
+    '''
+    Plays batches of a Coordinator until all batches are done (or
+    max_batches batches are played). The worker reconnects when the
+    connection is lost, and gives up after max_retries failed attempts.
+    Returns the number of batches played. Raises RuntimeError when the
+    coordinator refuses the records of a batch.
+    '''
+    unacked = None # (batch, records) not yet acknowledged
+    nb_batches = 0
+    retries = 0
+    while True:
+        try:
+            if path is not None:
+                sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                sock.connect(path)
+            else:
+                sock = socket.create_connection((host, port))
+        except OSError:
+            retries += 1
+            if retries > max_retries:
+                return(nb_batches)
+            time.sleep(retry_time)
+            continue
+        retries = 0
+        f = sock.makefile('rw')
+        try:
+            f.write('hello {}\n'.format(name))
+            while True:
+                if unacked is not None:
+                    (batch, records) = unacked
+                    f.write('result {} {}\n'.format(batch, json.dumps(records, separators = (',', ':'))))
+                    f.flush()
+                    line = f.readline()
+                    if not line:
+                        raise ConnectionError()
+                    if line.startswith('error'):
+                        # sending the same records again would be refused again
+                        raise RuntimeError('batch {} refused by the coordinator: {}'.format(
+                            batch, line[len('error'):].strip()))
+                    unacked = None
+                    nb_batches += 1
+                if max_batches is not None and nb_batches >= max_batches:
+                    return(nb_batches)
+                f.write('request\n')
+                f.flush()
+                line = f.readline()
+                if not line:
+                    raise ConnectionError()
+                fields = line.split(' ', 2)
+                if fields[0].strip() == 'finished':
+                    return(nb_batches)
+                if fields[0] == 'wait':
+                    time.sleep(float(fields[1]))
+                elif fields[0] == 'batch':
+                    unacked = (int(fields[1]), play_batch(json.loads(fields[2])))
+        except (OSError, ConnectionError):
+            time.sleep(retry_time)
+        finally:
+            f.close()
+            sock.close()
+
+# # Example on one machine, with local processes standing for the nodes
+# from multiprocessing import Process
+# async def main():
+#     coordinator = Coordinator(('mcts', {'simulations': 50}), 'selfplay.jsonl',
+#                               nb_batches = 20, batch_size = 2)
+#     await coordinator.start(port = 4100)
+#     workers = [Process(target = run_worker, args = ('w{}'.format(k), '127.0.0.1', 4100))
+#                for k in range(4)]
+#     [w.start() for w in workers]
+#     await coordinator.finished
+#     await coordinator.close()
+#     [w.join() for w in workers]
+# asyncio.run(main())
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description = 'Distributed self-play')
+    parser.add_argument('mode', choices = ['coordinator', 'worker'])
+    parser.add_argument('--host', default = '127.0.0.1')
+    parser.add_argument('--port', type = int, default = 4100)
+    parser.add_argument('--unix', default = None, help = 'path of a Unix socket')
+    parser.add_argument('--config', default = '["mcts", {"simulations": 200}]',
+                        help = 'JSON [kind, parameters] of the bot')
+    parser.add_argument('--records', default = 'selfplay.jsonl')
+    parser.add_argument('--batches', type = int, default = 100)
+    parser.add_argument('--batch-size', type = int, default = 8)
+    parser.add_argument('--max-leased', type = int, default = None)
+    parser.add_argument('--name', default = socket.gethostname())
+    args = parser.parse_args()
+
+    if args.mode == 'worker':
+        run_worker(args.name, args.host, args.port, args.unix)
+    else:
+        async def serve():
+            coordinator = Coordinator(json.loads(args.config), args.records, args.batches,
+                                      args.batch_size, max_leased = args.max_leased)
+            await coordinator.start(args.host, args.port, args.unix)
+            await coordinator.finished
+            await coordinator.close()
+        asyncio.run(serve())
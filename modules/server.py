@@ -0,0 +1,271 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import itertools
+import time
+from modules.engine import Position, PASS, get_geometry, move_to_text, text_to_move
+from modules.records import game_record, write_record
+
+'''
+   Asyncio game server for bot matches.
+
+   One process hosts any number of concurrent games. Bots connect with TCP or
+   a Unix socket and wait in a lobby; as soon as enough bots are waiting, a
+   game is started between them. Moves are checked with modules.engine, each
+   move has a time limit, and every finished game is appended at once to a
+   file of records (see modules.records).
+
+   Messages are lines of text.
+   Bot -> server:
+       hello <name>            first message of the bot
+       <color> <move>          answer to 'go', e.g. 'b V5 rr 5 5' or 'b pass'
+       ready                   after 'end', to wait for another game
+                               (other lines are ignored until 'ready')
+   Server -> bot:
+       start <game> <player> <colors>   e.g. 'start 12 0 b r'
+       go <color> <ms>                  the bot must play color within ms
+       move <color> <move>              a move was played (by any bot)
+       error <message>                  move refused, the color is out
+       end <scores>                     scores of players 0, 1, ...
+
+   An answer is tagged with its color: the late answer of a bot for a color
+   which is already out is dropped instead of being read as its next move.
+'''
+
+##############
+# Class Seat #
+##############
+class Seat():
+    '''A bot connected to the server.'''
+    def __init__(self, reader, writer, name):
+        self.reader = reader
+        self.writer = writer
+        self.name = name
+        self.finished = None # future set when the current game is over
+
+    def send(self, line):
+        try:
+            self.writer.write((line + '\n').encode())
+        except (ConnectionError, RuntimeError):
+            pass
+        return(None)
+
+    def connected(self):
+        '''False once the bot has closed the connection.'''
+        return(not (self.reader.at_eof() or self.writer.is_closing()))
+
+    async def drain(self):
+        try:
+            await self.writer.drain()
+        except ConnectionError:
+            pass
+        return(None)
+
+####################
+# Class GameServer #
+####################
+class GameServer():
+    '''
+    Hosts '2 players 4 colors' games between bots (nb_players bots per game).
+    move_time is the time limit of one move in seconds: a bot which does not
+    answer in time, disconnects or sends an illegal move loses the color, which
+    is then out of the game.
+    '''
+    def __init__(self, record_path = 'games.jsonl', move_time = 1.0,
+                 board_size = 20, max_rank = 5, players = (0, 1, 0, 1)):
+        self.geometry = get_geometry(board_size, max_rank)
+        self.players = list(players)
+        self.nb_players = len(set(self.players))
+        self.move_time = move_time
+        self.record_file = open(record_path, 'a')
+        self.lobby = []
+        self.games = set()
+        self.game_ids = itertools.count()
+        self.nb_games_played = 0
+
+    async def start(self, host = '127.0.0.1', port = 0, path = None):
+        '''Listens on a Unix socket if path is given, else on TCP.'''
+        if path is not None:
+            self.server = await asyncio.start_unix_server(self.handle, path = path)
+        else:
+            self.server = await asyncio.start_server(self.handle, host, port)
+        return(self.server)
+
+    async def close(self):
+        self.server.close()
+        await self.server.wait_closed()
+        for task in list(self.games):
+            task.cancel()
+        self.record_file.close()
+        return(None)
+
+    async def handle(self, reader, writer):
+        '''Connection of one bot: lobby, games, and again lobby on 'ready'.'''
+        line = (await reader.readline()).decode().split()
+        if len(line) < 1 or line[0] != 'hello':
+            writer.close()
+            return(None)
+        seat = Seat(reader, writer, ' '.join(line[1:]) or 'bot')
+        while True:
+            seat.finished = asyncio.get_running_loop().create_future()
+            self.lobby.append(seat)
+            self.prune_lobby()
+            if len(self.lobby) >= self.nb_players:
+                seats, self.lobby = self.lobby[:self.nb_players], self.lobby[self.nb_players:]
+                task = asyncio.create_task(self.play_game(seats))
+                self.games.add(task)
+                task.add_done_callback(self.games.discard)
+            await seat.finished
+            # Lines other than 'ready' (late answers of the game) are dropped
+            line = await reader.readline()
+            while line and line.strip() != b'ready':
+                line = await reader.readline()
+            if not line:
+                break
+        writer.close()
+        return(None)
+
+    def prune_lobby(self):
+        '''Removes from the lobby the bots which disconnected while waiting.'''
+        for seat in self.lobby:
+            if not seat.connected():
+                seat.finished.set_result(None)
+        self.lobby = [seat for seat in self.lobby if not seat.finished.done()]
+        return(None)
+
+    async def play_game(self, seats):
+        game_id = str(next(self.game_ids))
+        geometry = self.geometry
+        position = Position(geometry, self.players)
+        colors_of = [[c for c, p in zip(position.colors, self.players) if p == player]
+                     for player in range(self.nb_players)]
+        for player, seat in enumerate(seats):
+            seat.send('start {} {} {}'.format(game_id, player, ' '.join(colors_of[player])))
+
+        moves = []
+        times = []
+        while not position.is_end():
+            color = position.to_play
+            seat = seats[self.players[position.turn]]
+            move = PASS
+            begin = time.monotonic()
+            if position.has_legal_move():
+                seat.send('go {} {}'.format(color, int(self.move_time * 1000)))
+                await seat.drain()
+                move = await self.read_move(seat, position)
+            times.append(round(time.monotonic() - begin, 4))
+            position.play(move)
+            moves.append(move)
+            text = move_to_text(geometry, move)
+            for other in seats:
+                other.send('move {} {}'.format(color, text))
+
+        scores = position.player_scores()
+        for seat in seats:
+            seat.send('end ' + ' '.join(str(scores[p]) for p in range(self.nb_players)))
+            await seat.drain()
+        write_record(self.record_file, game_record(
+            position, moves, [seat.name for seat in seats], id = game_id, times = times))
+        self.nb_games_played += 1
+        for seat in seats:
+            if not seat.finished.done():
+                seat.finished.set_result(scores)
+        return(scores)
+
+    async def read_move(self, seat, position):
+        '''
+        Answer of the bot, or PASS if it is late, disconnected or illegal.
+        Answers tagged with another color (late answers) are dropped.
+        '''
+        color = position.to_play
+        deadline = time.monotonic() + self.move_time
+        while True:
+            try:
+                line = await asyncio.wait_for(seat.reader.readline(),
+                                              max(0.0, deadline - time.monotonic()))
+            except (asyncio.TimeoutError, ConnectionError):
+                seat.send('error time')
+                return(PASS)
+            if not line:
+                return(PASS)
+            fields = line.decode().split(' ', 1)
+            if len(fields) == 2 and fields[0] == color:
+                break
+        try:
+            move = text_to_move(self.geometry, fields[1])
+        except ValueError as e:
+            seat.send('error {}'.format(e))
+            return(PASS)
+        if not position.is_legal(move):
+            seat.send('error illegal move')
+            return(PASS)
+        return(move)
+
+##############
+# Bot client #
+##############
+async def run_bot(choose_move, name = 'bot', host = '127.0.0.1', port = None,
+                  path = None, nb_games = 1, board_size = 20, max_rank = 5,
+                  players = (0, 1, 0, 1)):
+    '''
+    Connects a bot to a GameServer and plays nb_games games.
+    choose_move(position) returns a placement id (or PASS) for position.to_play.
+    Returns the list of scores of the games.
+    '''
+    geometry = get_geometry(board_size, max_rank)
+    if path is not None:
+        reader, writer = await asyncio.open_unix_connection(path)
+    else:
+        reader, writer = await asyncio.open_connection(host, port)
+    writer.write('hello {}\n'.format(name).encode())
+    results = []
+    position = None
+    while len(results) < nb_games:
+        line = (await reader.readline()).decode()
+        if not line:
+            break
+        fields = line.split()
+        if fields[0] == 'start':
+            position = Position(geometry, players)
+        elif fields[0] == 'go':
+            move = choose_move(position)
+            writer.write('{} {}\n'.format(fields[1], move_to_text(geometry, move)).encode())
+            await writer.drain()
+        elif fields[0] == 'move':
+            position.play(text_to_move(geometry, ' '.join(fields[2:])))
+        elif fields[0] == 'end':
+            results.append([int(s) for s in fields[1:]])
+            if len(results) < nb_games:
+                writer.write(b'ready\n')
+    writer.close()
+    return(results)
+
+# # Example: 100 concurrent games between random bots
+# import random
+# from modules.engine import PASS
+# def random_bot(position):
+#     moves = position.legal_moves()
+#     return(random.choice(moves) if moves else PASS)
+#
+# async def main():
+#     server = GameServer('games.jsonl', move_time = 1.0)
+#     await server.start(port = 4000)
+#     await asyncio.gather(*[run_bot(random_bot, 'random', port = 4000) for _ in range(200)])
+#     await server.close()
+# asyncio.run(main())
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description = 'Blokus game server for bots')
+    parser.add_argument('--host', default = '127.0.0.1')
+    parser.add_argument('--port', type = int, default = 4000)
+    parser.add_argument('--unix', default = None, help = 'path of a Unix socket')
+    parser.add_argument('--records', default = 'games.jsonl')
+    parser.add_argument('--move-time', type = float, default = 1.0)
+    args = parser.parse_args()
+
+    async def serve():
+        server = GameServer(args.records, args.move_time)
+        await server.start(args.host, args.port, args.unix)
+        async with server.server:
+            await server.server.serve_forever()
+    asyncio.run(serve())
@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+import struct
+from array import array
+from multiprocessing import shared_memory
+from modules.engine import ORIENTATIONS, Geometry, _geometries, move_typecode
+
+'''
+   Geometry tables in shared memory.
+
+   A process builds the tables of a Geometry once and publishes them into a
+   block of shared memory (publish_geometry). Worker processes attach to this
+   block (attach_geometry): their tables are read only views on the shared
+   block, nothing is rebuilt, and all processes use the same pages of memory.
+
+   The masks are the only table read at each candidate placement during move
+   generation, and reading them as Python integers from the block would make
+   it about four times slower. So by default each worker decodes its own list
+   of masks (a few milliseconds and megabytes); with decode_masks = False
+   they are also read from the block, using less memory but more time.
+
+   Layout of the block (little endian):
+   - header: board_size, max_rank, number of pieces, number of placements,
+     number of bytes of a mask, and length of the names of the pieces,
+   - names of the pieces (ascii, separated by spaces), size of each piece,
+   - for each placement: piece index, orientation index, x, y (1 byte each),
+   - for each placement: its mask (cells of modules.engine, fixed size),
+   - by_cell as two arrays of 4 bytes integers: for (cell, piece), the
+     placements are ids[offsets[k]:offsets[k + 1]] with k = cell * nb_pieces + piece.
+'''
+
+HEADER = struct.Struct('<BBHIHH')
+
+def geometry_to_bytes(geometry):
+    '''Flat bytes of the tables of geometry.'''
+    nb_pieces = len(geometry.piece_names)
+    nb_placements = len(geometry.masks)
+    width = (geometry.nb_cells + 7) // 8
+    names = ' '.join(geometry.piece_names).encode('ascii')
+
+    pieces = bytearray(4 * nb_placements)
+    for pid, (piece_name, orientation, (x, y)) in enumerate(geometry.placements):
+        pieces[4 * pid:4 * pid + 4] = bytes([geometry.pieces[pid], geometry.orientations[pid], x, y])
+    masks = b''.join(mask.to_bytes(width, 'little') for mask in geometry.masks)
+    offsets = [0]
+    ids = []
+    for by_piece in geometry.by_cell:
+        for pids in by_piece:
+            ids.extend(pids)
+            offsets.append(len(ids))
+    return(b''.join([
+        HEADER.pack(geometry.board_size, geometry.max_rank, nb_pieces,
+                    nb_placements, width, len(names)),
+        names,
+        bytes(geometry.piece_sizes),
+        bytes(pieces),
+        masks,
+        array('I', offsets).tobytes(),
+        array('I', ids).tobytes(),
+    ]))
+
+#############
+# Read only #
+#############
+class _Masks():
+    '''masks[pid] read from the shared block.'''
+    def __init__(self, view, width, nb_placements):
+        self.view = view
+        self.width = width
+        self.nb_placements = nb_placements
+
+    def __len__(self):
+        return(self.nb_placements)
+
+    def __getitem__(self, pid):
+        w = self.width
+        return(int.from_bytes(self.view[pid * w:(pid + 1) * w], 'little'))
+
+class _Placements():
+    '''placements[pid] == (piece_name, orientation, (x, y)) read from the shared block.'''
+    def __init__(self, view, piece_names):
+        self.view = view
+        self.piece_names = piece_names
+
+    def __len__(self):
+        return(len(self.view) // 4)
+
+    def __getitem__(self, pid):
+        (piece, orientation, x, y) = self.view[4 * pid:4 * pid + 4]
+        return((self.piece_names[piece], ORIENTATIONS[orientation], (x, y)))
+
+class _ByCell():
+    '''by_cell[cell][piece] is a view on the placement ids of the shared block.'''
+    def __init__(self, offsets, ids, nb_pieces):
+        self.offsets = offsets
+        self.ids = ids
+        self.nb_pieces = nb_pieces
+
+    def __len__(self):
+        return((len(self.offsets) - 1) // self.nb_pieces)
+
+    def __getitem__(self, cell):
+        k = cell * self.nb_pieces
+        offsets = self.offsets[k:k + self.nb_pieces + 1]
+        ids = self.ids
+        return([ids[offsets[i]:offsets[i + 1]] for i in range(self.nb_pieces)])
+
+########################
+# Class SharedGeometry #
+########################
+class SharedGeometry(Geometry):
+    '''Geometry whose tables are views on a block of bytes (see geometry_to_bytes).'''
+    def __init__(self, buffer, decode_masks = True):
+        view = memoryview(buffer)
+        (board_size, max_rank, nb_pieces, nb_placements, width, names_length) = \
+            HEADER.unpack_from(view, 0)
+        self.board_size = board_size
+        self.max_rank = max_rank
+        self.stride = board_size + 1
+        self.nb_cells = board_size * self.stride
+        self.board_mask = sum(1 << self.cell(x, y)
+                              for x in range(board_size) for y in range(board_size))
+
+        i = HEADER.size
+        self.piece_names = bytes(view[i:i + names_length]).decode('ascii').split(' ')
+        i += names_length
+        self.piece_index = {name: k for k, name in enumerate(self.piece_names)}
+        self.piece_sizes = list(view[i:i + nb_pieces])
+        self.all_pieces = (1 << nb_pieces) - 1
+        i += nb_pieces
+
+        placements = view[i:i + 4 * nb_placements]
+        self.pieces = placements[0::4]
+        self.orientations = placements[1::4]
+        self.origins = array('H', [x * self.stride + y for (x, y) in
+                                   zip(placements[2::4], placements[3::4])])
+        self.move_typecode = move_typecode(nb_placements)
+        self.set_priorities()
+        self.placements = _Placements(placements, self.piece_names)
+        i += 4 * nb_placements
+        self.masks = _Masks(view[i:i + width * nb_placements], width, nb_placements)
+        if decode_masks:
+            self.masks = [self.masks[pid] for pid in range(nb_placements)]
+        i += width * nb_placements
+        nb_offsets = self.nb_cells * nb_pieces + 1
+        offsets = view[i:i + 4 * nb_offsets].cast('I')
+        i += 4 * nb_offsets
+        ids = view[i:i + 4 * offsets[-1]].cast('I')
+        self.by_cell = _ByCell(offsets, ids, nb_pieces)
+        self._ids = None
+
+    @property
+    def ids(self):
+        '''(piece_name, orientation, position) -> placement id, built when first needed.'''
+        if self._ids is None:
+            placements = self.placements
+            self._ids = {placements[pid]: pid for pid in range(len(placements))}
+        return(self._ids)
+
+#################
+# Shared memory #
+#################
+def publish_geometry(geometry, name = None):
+    '''
+    Copies the tables of geometry into a new block of shared memory and
+    returns it. The caller keeps it alive while workers use it, then calls
+    close() and unlink().
+    '''
+    data = geometry_to_bytes(geometry)
+    block = shared_memory.SharedMemory(name = name, create = True, size = len(data))
+    block.buf[:len(data)] = data
+    return(block)
+
+def attach_geometry(name, decode_masks = True):
+    '''
+    Geometry of a block published by publish_geometry, used from now on by
+    get_geometry() (and so by all positions) of this process.
+    '''
+    try:
+        block = shared_memory.SharedMemory(name = name, track = False)
+    except TypeError:
+        # Before Python 3.13 the block is tracked by the resource tracker of
+        # the process which created it (shared with its pool of workers),
+        # which unlinks it only if the creator forgets to.
+        block = shared_memory.SharedMemory(name = name)
+    geometry = SharedGeometry(block.buf, decode_masks)
+    geometry.block = block # keeps the block opened
+    _geometries[(geometry.board_size, geometry.max_rank)] = geometry
+    return(geometry)
+
+# # Example with a pool of workers
+# from multiprocessing import Pool
+# from modules.engine import get_geometry, Position
+# block = publish_geometry(get_geometry(20, 5))
+# def count_moves(data):
+#     return(len(Position.from_bytes(data).legal_moves()))
+# with Pool(64, initializer = attach_geometry, initargs = (block.name,)) as pool:
+#     pool.map(count_moves, [Position().to_bytes()] * 1000)
+# block.close()
+# block.unlink()
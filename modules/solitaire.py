@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+import time
+from multiprocessing import Pool
+from modules.engine import bits, get_geometry, popcount, move_to_text
+from modules.piece import BagOfPieces
+from modules.shared import publish_geometry, attach_geometry
+
+'''
+   Solitaire: one color alone on a board, placing as many cells as possible.
+
+   The pieces of one BagOfPieces are placed with the rules of the game (the
+   first piece covers the start cell, then each piece touches a corner of the
+   color and no edge of it), on a board of any size, possibly with fixed
+   obstacles. The goal is a sequence of placements covering the maximal
+   number of cells: it measures the coverage of a set of pieces on a custom
+   board, and it is a benchmark of move generation.
+
+   The search is a beam search: at each depth every state of the beam is
+   expanded with all its legal placements, states reached twice (same cells,
+   same pieces left) are kept once, and the width best states by covered
+   cells (plus a bonus per free corner) form the next beam. With processes,
+   the beam is split between a pool of workers which expand their part and
+   send back only their width best children.
+'''
+
+###################
+# Class Solitaire #
+###################
+class Solitaire():
+    '''
+    bag is a BagOfPieces (all pieces of rank at most 5 by default, remove
+    pieces from it for a custom set), obstacles a list of points (x, y) where
+    no piece can be put, and start the point that the first piece must cover.
+    A state is (occupancy, remaining, moves) as in modules.engine.Position.
+    '''
+    def __init__(self, bag = None, board_size = 20, obstacles = (), start = (0, 0)):
+        if bag is None:
+            bag = BagOfPieces(None, None, 5)
+        self.board_size = board_size
+        self.max_rank = max(len(piece) for piece in bag)
+        self.piece_names = [piece.name for piece in bag]
+        self.obstacle_points = [tuple(point) for point in obstacles]
+        self.start_point = tuple(start)
+        self.set_geometry()
+        if self.start & self.obstacles:
+            raise ValueError('The start cell is an obstacle')
+
+    def set_geometry(self):
+        geometry = get_geometry(self.board_size, self.max_rank)
+        self.geometry = geometry
+        self.pieces = 0
+        for name in self.piece_names:
+            if name not in geometry.piece_index:
+                raise ValueError('Unknown piece {}'.format(name))
+            self.pieces |= 1 << geometry.piece_index[name]
+        self.obstacles = sum(1 << geometry.cell(*point) for point in set(self.obstacle_points))
+        self.start = 1 << geometry.cell(*self.start_point)
+        return(None)
+
+    def __getstate__(self):
+        # Sent to the workers without the tables, which they rebuild or attach
+        return({'board_size': self.board_size, 'max_rank': self.max_rank,
+                'piece_names': self.piece_names, 'obstacle_points': self.obstacle_points,
+                'start_point': self.start_point})
+
+    def __setstate__(self, state):
+        # The tables are resolved at first use: in a worker, unpickling runs
+        # before _init_worker attaches the shared geometry
+        self.__dict__.update(state)
+        return(None)
+
+    def __getattr__(self, name):
+        if name in ('geometry', 'pieces', 'obstacles', 'start'):
+            self.set_geometry()
+            return(self.__dict__[name])
+        raise AttributeError(name)
+
+    def initial_state(self):
+        return((0, self.pieces, ()))
+
+    def anchors(self, occupancy):
+        '''Cells where the next piece can touch a corner of the color.'''
+        geometry = self.geometry
+        forbidden = occupancy | self.obstacles | geometry.edge_dilate(occupancy)
+        if not occupancy:
+            return(self.start & ~forbidden, forbidden)
+        return(geometry.diagonal_dilate(occupancy) & ~forbidden, forbidden)
+
+    def legal_moves(self, occupancy, remaining):
+        geometry = self.geometry
+        masks = geometry.masks
+        (anchors, forbidden) = self.anchors(occupancy)
+        pieces = list(bits(remaining))
+        seen = set()
+        moves = []
+        for cell in bits(anchors):
+            by_piece = geometry.by_cell[cell]
+            for i in pieces:
+                for pid in by_piece[i]:
+                    if not masks[pid] & forbidden and pid not in seen:
+                        seen.add(pid)
+                        moves.append(pid)
+        return(moves)
+
+    def score(self, occupancy, corner_weight):
+        return(popcount(occupancy) + corner_weight * popcount(self.anchors(occupancy)[0]))
+
+    def best(self, children, width, corner_weight):
+        '''
+        width best states of a dict (occupancy, remaining) -> moves. Ties are
+        broken by the state itself, so that the beam does not depend on how it
+        was split between the workers.
+        '''
+        ranked = sorted(children, key = lambda child: (-self.score(child[0], corner_weight), child))
+        return([child + (children[child],) for child in ranked[:width]])
+
+    def expand(self, states, width, corner_weight = 0.5):
+        '''
+        (width best children of states, best state without legal move, number
+        of states expanded), children being deduplicated.
+        '''
+        geometry = self.geometry
+        (masks, pieces) = (geometry.masks, geometry.pieces)
+        children = dict()
+        best_final = None
+        for (occupancy, remaining, moves) in states:
+            legal = self.legal_moves(occupancy, remaining)
+            if not legal:
+                if best_final is None or popcount(occupancy) > popcount(best_final[0]):
+                    best_final = (occupancy, remaining, moves)
+                continue
+            for move in legal:
+                child = (occupancy | masks[move], remaining & ~(1 << pieces[move]))
+                if child not in children:
+                    children[child] = moves + (move,)
+        return(self.best(children, width, corner_weight), best_final, len(states))
+
+    def solve(self, width = 64, processes = 1, corner_weight = 0.5, callback = None):
+        '''
+        Beam search of width states, expanded by processes processes: returns
+        the best final state (occupancy, remaining, moves). callback(depth,
+        beam, best) is called after each depth.
+        '''
+        self.nodes = 0
+        beam = [self.initial_state()]
+        best = beam[0]
+        pool = None
+        block = None
+        try:
+            if processes != 1:
+                block = publish_geometry(self.geometry)
+                pool = Pool(processes, initializer = _init_worker, initargs = (block.name, self))
+            depth = 0
+            while beam:
+                if pool is None:
+                    results = [self.expand(beam, width, corner_weight)]
+                else:
+                    nb_chunks = min(len(beam), 4 * (processes or 1))
+                    chunks = [beam[k::nb_chunks] for k in range(nb_chunks)]
+                    results = pool.map(_expand, [(chunk, width, corner_weight) for chunk in chunks])
+                children = dict()
+                for (ranked, final, nodes) in results:
+                    self.nodes += nodes
+                    if final is not None and popcount(final[0]) > popcount(best[0]):
+                        best = final
+                    for (occupancy, remaining, moves) in ranked:
+                        children.setdefault((occupancy, remaining), moves)
+                beam = self.best(children, width, corner_weight)
+                depth += 1
+                if callback is not None:
+                    callback(depth, beam, best)
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+            if block is not None:
+                block.close()
+                block.unlink()
+        return(best)
+
+    def covered(self, state):
+        return(popcount(state[0]))
+
+    def text_repr(self, state):
+        '''Prints the board: 'x' for the color, '#' for the obstacles.'''
+        geometry = self.geometry
+        table = [['.'] * self.board_size for _ in range(self.board_size)]
+        for (x, y) in geometry.points(self.obstacles):
+            table[x][y] = '#'
+        for (x, y) in geometry.points(state[0]):
+            table[x][y] = 'x'
+        print('\n'.join(''.join(row) for row in table))
+        return(None)
+
+    def moves_text(self, state):
+        return([move_to_text(self.geometry, move) for move in state[2]])
+
+###########
+# Workers #
+###########
+_solitaire = None
+
+def _init_worker(name, solitaire):
+    global _solitaire
+    attach_geometry(name)
+    solitaire.set_geometry()
+    _solitaire = solitaire
+    return(None)
+
+def _expand(task):
+    (states, width, corner_weight) = task
+    return(_solitaire.expand(states, width, corner_weight))
+
+# # Example: coverage of the 21 pieces on a 10 x 10 board with a hole
+# solitaire = Solitaire(board_size = 10, obstacles = [(4, 4), (4, 5), (5, 4), (5, 5)])
+# best = solitaire.solve(width = 256, processes = 4)
+# solitaire.covered(best)
+# solitaire.text_repr(best)
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description = 'Maximal placement of one bag of pieces')
+    parser.add_argument('--board-size', type = int, default = 20)
+    parser.add_argument('--max-rank', type = int, default = 5)
+    parser.add_argument('--width', type = int, default = 64)
+    parser.add_argument('--processes', type = int, default = 1)
+    args = parser.parse_args()
+
+    solitaire = Solitaire(BagOfPieces(None, None, args.max_rank), args.board_size)
+    start = time.monotonic()
+    best = solitaire.solve(args.width, args.processes,
+                           callback = lambda depth, beam, best: print(depth, len(beam), flush = True))
+    print('{} cells covered, {} states expanded in {:.2f} s'.format(
+        solitaire.covered(best), solitaire.nodes, time.monotonic() - start))
+    solitaire.text_repr(best)
@@ -0,0 +1,356 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import json
+import math
+import os
+import random
+from itertools import islice
+from multiprocessing import Pool
+from modules.engine import Position, PASS, get_geometry
+from modules.mcts import MCTSPlayer, lazy_playout, random_playout
+from modules.endgame import EndgameSolver
+from modules.evaluation import Influence, default_weights, evaluate
+from modules.cache import MoveCache
+from modules.records import game_record, write_record
+from modules.shared import publish_geometry, attach_geometry
+
+'''
+   Tournaments between bots, played by a pool of processes.
+
+   A bot is given by a configuration (kind, parameters), for example
+   ('mcts', {'simulations': 200}), kinds being the keys of PLAYER_KINDS.
+   Parameters are plain JSON values, so that a configuration can be sent to
+   the workers and written in the cache.
+
+   Games are "2 players 4 colors" games (players (0, 1, 0, 1) by default):
+   the player of the first color has an advantage, so each game of a pairing
+   is played twice with the same seed, once with each bot as player 0.
+
+   Each finished game is appended to the cache file (a file of game records,
+   see modules.records) with a key depending on the configurations, the seed
+   and the rules. When a tournament is run again, games already in the cache
+   are not played again: an interrupted run resumes where it stopped, and
+   adding a bot only plays its new games.
+
+   Ratings are Elo ratings of a Bradley-Terry model fitted on all results (a
+   draw is half a win), with confidence intervals by bootstrap over games.
+'''
+
+ELO = 400.0 / math.log(10) # Elo points per unit of log strength
+
+###########
+# Players #
+###########
+class RandomPlayer():
+    def __init__(self, seed = None):
+        self.rng = random.Random(seed)
+
+    def choose_move(self, position):
+        moves = position.legal_moves()
+        return(self.rng.choice(moves) if moves else PASS)
+
+    def think(self, position, deadline, soft_deadline = None):
+        return(self.choose_move(position))
+
+class HeuristicPlayer():
+    '''
+    Plays the move with the best evaluation (modules.evaluation with weights)
+    among candidates moves of Position.iter_moves (the largest pieces, in
+    random order), one ply deep.
+    '''
+    def __init__(self, weights = None, candidates = 12, depth = 1, seed = None):
+        self.weights = dict(default_weights)
+        self.weights.update(weights or {})
+        self.candidates = candidates
+        self.depth = depth
+        self.rng = random.Random(seed)
+
+    def choose_move(self, position):
+        moves = list(islice(position.iter_moves(rng = self.rng), self.candidates))
+        if len(moves) < 2:
+            return(moves[0] if moves else PASS)
+        (turn, player) = (position.turn, position.players[position.turn])
+        influence = Influence(position, self.depth)
+        best = None
+        for move in moves:
+            child = position.copy()
+            child.play(move)
+            child_influence = influence.copy()
+            child_influence.update(move, turn)
+            value = evaluate(child, child_influence, self.weights)[player]
+            if best is None or value > best[0]:
+                best = (value, move)
+        return(best[1])
+
+    def think(self, position, deadline, soft_deadline = None):
+        return(self.choose_move(position))
+
+PLAYOUTS = {'random': random_playout, 'lazy': lazy_playout}
+
+def make_mcts_player(seed = None, endgame = None, move_cache = None, playout = 'random', **parameters):
+    '''
+    MCTSPlayer; endgame is max_moves of an EndgameSolver, move_cache a size in
+    bytes, playout a key of PLAYOUTS.
+    '''
+    parameters['playout'] = PLAYOUTS[playout]
+    if endgame is not None:
+        endgame = EndgameSolver(max_moves = endgame)
+    if move_cache is not None:
+        move_cache = MoveCache(max_bytes = move_cache)
+    return(MCTSPlayer(seed = seed, endgame = endgame, move_cache = move_cache, **parameters))
+
+PLAYER_KINDS = {'random': RandomPlayer, 'mcts': make_mcts_player, 'heuristic': HeuristicPlayer}
+
+def make_player(config, seed = None):
+    (kind, parameters) = config
+    return(PLAYER_KINDS[kind](seed = seed, **parameters))
+
+###########
+# Workers #
+###########
+def play_game(task):
+    '''
+    Plays the game of task (a dict, see Tournament.schedule) and returns its
+    record, with the score of the bot seated as player 0 (1, 0.5 or 0).
+    '''
+    geometry = get_geometry(task['board_size'], task['max_rank'])
+    position = Position(geometry, task['players'])
+    bots = [make_player(task['configs'][k], task['seed'] * 2 + k) for k in range(2)]
+    moves = []
+    while not position.is_end():
+        move = bots[position.players[position.turn]].choose_move(position)
+        moves.append(move)
+        position.play(move)
+    scores = position.player_scores()
+    if scores[0] == scores[1]:
+        result = 0.5
+    else:
+        result = 1.0 if scores[0] > scores[1] else 0.0
+    return(game_record(position, moves, task['names'], key = task['key'],
+                       seed = task['seed'], result = result))
+
+def game_key(first, second, seed, players, board_size, max_rank, names = None):
+    '''
+    Key of the game between configurations first (player 0) and second, in
+    the cache. With names, the key also depends on the names of the bots, so
+    that two bots with the same configuration are credited their own games.
+    '''
+    data = [first, second, seed, list(players), board_size, max_rank]
+    if names is not None:
+        data.append(list(names))
+    data = json.dumps(data, sort_keys = True)
+    return(hashlib.sha1(data.encode('utf-8')).hexdigest())
+
+def _init_worker(block_name):
+    if block_name is not None:
+        attach_geometry(block_name)
+
+def read_cache(path):
+    '''Records of the cache file by key (a line cut by an interruption is ignored).'''
+    records = dict()
+    if not os.path.exists(path):
+        return(records)
+    with open(path) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            records[record['key']] = record
+    return(records)
+
+#######
+# Elo #
+#######
+def game_results(records):
+    '''(name of player 0, name of player 1, score of player 0) of each record.'''
+    return([(record['names'][0], record['names'][1], record['result']) for record in records])
+
+def fit_ratings(results, names = None, iterations = 200):
+    '''
+    Elo ratings (mean 0) of the Bradley-Terry model fitted on results (see
+    game_results), with the iterations of the minorization-maximization
+    algorithm. Each pair of bots which played is given one more virtual
+    draw, so that a bot without wins or losses still has a finite rating.
+    '''
+    if names is None:
+        names = sorted(set(a for a, _, _ in results) | set(b for _, b, _ in results))
+    index = {name: k for k, name in enumerate(names)}
+    n = len(names)
+    wins = [0.0] * n
+    games = dict()
+    for (a, b, score) in results:
+        (i, j) = (index[a], index[b])
+        wins[i] += score
+        wins[j] += 1.0 - score
+        games[(i, j)] = games.get((i, j), 0) + 1
+        games[(j, i)] = games.get((j, i), 0) + 1
+    for (i, j) in games:
+        if i < j:
+            games[(i, j)] += 1
+            games[(j, i)] += 1
+            wins[i] += 0.5
+            wins[j] += 0.5
+
+    strengths = [1.0] * n
+    for _ in range(iterations):
+        new = []
+        for i in range(n):
+            denominator = sum(count / (strengths[i] + strengths[j])
+                              for (k, j), count in games.items() if k == i)
+            new.append(wins[i] / denominator if denominator > 0 else strengths[i])
+        mean_log = sum(math.log(s) for s in new) / n
+        strengths = [s / math.exp(mean_log) for s in new]
+    return({name: ELO * math.log(strengths[index[name]]) for name in names})
+
+def rating_intervals(results, confidence = 0.95, nb_samples = 200, seed = 0):
+    '''
+    (rating, low, high) of each bot: ratings of fit_ratings and their
+    confidence interval, from the ratings of nb_samples bootstrap samples
+    of the games.
+    '''
+    names = sorted(set(a for a, _, _ in results) | set(b for _, b, _ in results))
+    ratings = fit_ratings(results, names)
+    rng = random.Random(seed)
+    samples = {name: [] for name in names}
+    for _ in range(nb_samples):
+        sample = [rng.choice(results) for _ in results]
+        for name, rating in fit_ratings(sample, names, iterations = 50).items():
+            samples[name].append(rating)
+    tail = (1.0 - confidence) / 2
+    output = dict()
+    for name in names:
+        values = sorted(samples[name])
+        low = values[int(tail * (len(values) - 1))]
+        high = values[int(math.ceil((1.0 - tail) * (len(values) - 1)))]
+        output[name] = (ratings[name], low, high)
+    return(output)
+# # Example
+# results = [('a', 'b', 1.0), ('b', 'a', 0.5), ('a', 'c', 1.0), ('c', 'b', 0.0)]
+# fit_ratings(results)
+# rating_intervals(results)
+
+####################
+# Class Tournament #
+####################
+class Tournament():
+    '''
+    Tournament between the bots of configs, a dict name -> (kind, parameters).
+    Results are cached in cache_path. processes is the number of workers
+    (None: one per cpu).
+    '''
+    def __init__(self, configs, cache_path = 'tournament.jsonl', board_size = 20,
+                 max_rank = 5, players = (0, 1, 0, 1), processes = None):
+        if sorted(set(players)) != [0, 1]:
+            raise ValueError('Tournaments are played between two players')
+        self.configs = configs
+        self.cache_path = cache_path
+        self.board_size = board_size
+        self.max_rank = max_rank
+        self.players = tuple(players)
+        self.processes = processes
+        self.records = read_cache(cache_path)
+
+    def game_key(self, first, second, seed):
+        return(game_key(self.configs[first], self.configs[second], seed,
+                        self.players, self.board_size, self.max_rank, (first, second)))
+
+    def schedule(self, pairs, rounds = 1, seed = 0):
+        '''
+        Games of rounds rounds between each pair of bots: in each round, the
+        two bots play the same seed twice, swapping their seats.
+        '''
+        tasks = []
+        for (a, b) in pairs:
+            for r in range(rounds):
+                game_seed = seed + r
+                for (first, second) in [(a, b), (b, a)]:
+                    tasks.append({
+                        'key': self.game_key(first, second, game_seed),
+                        'names': [first, second],
+                        'configs': [self.configs[first], self.configs[second]],
+                        'seed': game_seed,
+                        'board_size': self.board_size,
+                        'max_rank': self.max_rank,
+                        'players': list(self.players),
+                    })
+        return(tasks)
+
+    def round_robin(self, rounds = 1, seed = 0):
+        names = sorted(self.configs)
+        pairs = [(a, b) for i, a in enumerate(names) for b in names[i + 1:]]
+        return(self.schedule(pairs, rounds, seed))
+
+    def gauntlet(self, challenger, rounds = 1, seed = 0):
+        pairs = [(challenger, name) for name in sorted(self.configs) if name != challenger]
+        return(self.schedule(pairs, rounds, seed))
+
+    def run(self, tasks, callback = None):
+        '''
+        Plays the games of tasks which are not in the cache, writing each one
+        to the cache as soon as it is finished, and returns the records of
+        all tasks. callback(record) is called after each new game.
+        '''
+        todo = [task for task in tasks if task['key'] not in self.records]
+        if todo:
+            geometry = get_geometry(self.board_size, self.max_rank)
+            block = publish_geometry(geometry) if self.processes != 1 else None
+            try:
+                with open(self.cache_path, 'a') as f, \
+                     Pool(self.processes, initializer = _init_worker,
+                          initargs = (block.name if block else None,)) as pool:
+                    for record in pool.imap_unordered(play_game, todo):
+                        write_record(f, record)
+                        self.records[record['key']] = record
+                        if callback is not None:
+                            callback(record)
+            finally:
+                if block is not None:
+                    block.close()
+                    block.unlink()
+        return([self.records[task['key']] for task in tasks])
+
+    def standings(self, records = None, confidence = 0.95):
+        '''Text table of the ratings, best first.'''
+        if records is None:
+            records = list(self.records.values())
+        results = game_results(records)
+        ratings = rating_intervals(results, confidence)
+        nb_games = dict()
+        for (a, b, _) in results:
+            nb_games[a] = nb_games.get(a, 0) + 1
+            nb_games[b] = nb_games.get(b, 0) + 1
+        lines = ['{:<20} {:>7} {:>16} {:>6}'.format('bot', 'elo', 'interval', 'games')]
+        for name, (rating, low, high) in sorted(ratings.items(), key = lambda x: -x[1][0]):
+            interval = '[{:.0f}, {:.0f}]'.format(low, high)
+            lines.append('{:<20} {:>7.0f} {:>16} {:>6}'.format(name, rating, interval, nb_games[name]))
+        return('\n'.join(lines))
+
+# # Example
+# configs = {'random': ('random', {}),
+#            'mcts 50': ('mcts', {'simulations': 50}),
+#            'mcts 200': ('mcts', {'simulations': 200, 'endgame': 25})}
+# tournament = Tournament(configs, 'tournament.jsonl')
+# tournament.run(tournament.round_robin(rounds = 10), callback = lambda r: print(r['names'], r['result']))
+# print(tournament.standings())
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description = 'Tournament between bots')
+    parser.add_argument('configs', help = 'JSON file: {name: [kind, parameters]}')
+    parser.add_argument('--cache', default = 'tournament.jsonl')
+    parser.add_argument('--rounds', type = int, default = 1)
+    parser.add_argument('--gauntlet', default = None, help = 'name of the challenger')
+    parser.add_argument('--processes', type = int, default = None)
+    parser.add_argument('--board-size', type = int, default = 20)
+    args = parser.parse_args()
+
+    with open(args.configs) as f:
+        configs = {name: tuple(config) for name, config in json.load(f).items()}
+    tournament = Tournament(configs, args.cache, args.board_size, processes = args.processes)
+    if args.gauntlet is not None:
+        tasks = tournament.gauntlet(args.gauntlet, args.rounds)
+    else:
+        tasks = tournament.round_robin(args.rounds)
+    tournament.run(tasks, callback = lambda r: print(r['names'], r['result'], flush = True))
+    print(tournament.standings())
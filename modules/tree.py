@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+from array import array
+
+'''
+   Compact storage of a search tree.
+
+   Nodes are not Python objects: a node is an index, and each attribute of the
+   nodes is stored in its own array (structure of arrays). Arrays are
+   allocated with a capacity which is doubled when it is full, so that adding
+   nodes does not allocate memory at each node.
+
+   The children of a node are created all at once when the node is expanded,
+   so that they are contiguous: children of node i are the nodes
+   first_child[i], ..., first_child[i] + nb_children[i] - 1.
+'''
+
+NO_NODE = -1
+
+##############
+# Class Tree #
+##############
+class Tree():
+    '''
+    Search tree stored in arrays. For each node:
+    - visits: number of simulations through the node,
+    - value_sums: sum of the rewards of those simulations, for the color
+      which played the move leading to the node,
+    - priors: prior probability of the move leading to the node,
+    - moves: placement id of the move leading to the node (or PASS),
+    - turns: color number which played this move,
+    - parents, first_child, nb_children: links between nodes
+      (first_child is NO_NODE while the node is not expanded).
+    The root is node 0.
+    '''
+    fields = [('visits', 'i'), ('value_sums', 'd'), ('priors', 'f'),
+              ('moves', 'i'), ('turns', 'b'), ('parents', 'i'),
+              ('first_child', 'i'), ('nb_children', 'i')]
+
+    def __init__(self, capacity = 1024):
+        self.capacity = 0
+        self.size = 0
+        for name, typecode in self.fields:
+            setattr(self, name, array(typecode))
+        self.reserve(capacity)
+        self.add_root()
+
+    def reserve(self, size):
+        '''Makes sure that size nodes fit in the arrays.'''
+        if size <= self.capacity:
+            return(None)
+        capacity = max(self.capacity * 2, size, 16)
+        for name, typecode in self.fields:
+            getattr(self, name).extend(array(typecode, [0]) * (capacity - self.capacity))
+        self.capacity = capacity
+        return(None)
+
+    def add_root(self, move = -1, turn = -1):
+        '''Removes all nodes and creates the root.'''
+        self.size = 0
+        first = self.add_children(NO_NODE, [move], [1.0], turn)
+        return(first)
+
+    def add_children(self, parent, moves, priors, turn):
+        '''
+        Creates the children of parent, one per move, and returns the index of
+        the first one. turn is the color number playing those moves.
+        '''
+        first = self.size
+        n = len(moves)
+        self.reserve(first + n)
+        self.size = first + n
+        self.moves[first:first + n] = array('i', moves)
+        self.priors[first:first + n] = array('f', priors)
+        self.visits[first:first + n] = array('i', [0]) * n
+        self.value_sums[first:first + n] = array('d', [0.0]) * n
+        self.turns[first:first + n] = array('b', [turn]) * n
+        self.parents[first:first + n] = array('i', [parent]) * n
+        self.first_child[first:first + n] = array('i', [NO_NODE]) * n
+        self.nb_children[first:first + n] = array('i', [0]) * n
+        if parent != NO_NODE:
+            self.first_child[parent] = first
+            self.nb_children[parent] = n
+        return(first)
+
+    def is_expanded(self, node):
+        return(self.first_child[node] != NO_NODE)
+
+    def children(self, node):
+        first = self.first_child[node]
+        if first == NO_NODE:
+            return(range(0))
+        return(range(first, first + self.nb_children[node]))
+
+    def child(self, node, move):
+        '''Child of node reached by move, or NO_NODE.'''
+        for child in self.children(node):
+            if self.moves[child] == move:
+                return(child)
+        return(NO_NODE)
+
+    def backup(self, node, rewards):
+        '''Adds a simulation from node up to the root, rewards given per color.'''
+        visits = self.visits
+        value_sums = self.value_sums
+        turns = self.turns
+        parents = self.parents
+        while node != NO_NODE:
+            visits[node] += 1
+            if turns[node] >= 0:
+                value_sums[node] += rewards[turns[node]]
+            node = parents[node]
+        return(None)
+
+    def promote(self, node):
+        '''
+        Makes node the new root: its subtree is copied at the beginning of the
+        arrays and all other nodes are freed at once.
+        '''
+        if node == 0:
+            return(None)
+        if node == NO_NODE:
+            self.add_root()
+            return(None)
+        # Breadth first order of the subtree keeps the children contiguous
+        order = array('i', [node])
+        i = 0
+        while i < len(order):
+            first = self.first_child[order[i]]
+            if first != NO_NODE:
+                order.extend(range(first, first + self.nb_children[order[i]]))
+            i += 1
+        new_index = array('i', [NO_NODE]) * self.size
+        for new, old in enumerate(order):
+            new_index[old] = new
+        for name, typecode in self.fields:
+            old_values = getattr(self, name)
+            values = array(typecode, [old_values[old] for old in order])
+            if name in ('parents', 'first_child'):
+                values = array(typecode, [new_index[v] if v != NO_NODE else NO_NODE
+                                          for v in values])
+            values.extend(array(typecode, [0]) * (self.capacity - len(order)))
+            setattr(self, name, values)
+        self.parents[0] = NO_NODE
+        self.size = len(order)
+        return(None)
+
+    def nbytes(self):
+        '''Memory used by the arrays, in bytes.'''
+        return(sum(getattr(self, name).itemsize * self.capacity for name, _ in self.fields))
+
+# # Example
+# tree = Tree()
+# first = tree.add_children(0, [10, 11, 12], [1/3] * 3, turn = 0)
+# tree.backup(first + 1, rewards = [1.0, 0.0, 1.0, 0.0])
+# list(tree.children(0)), tree.visits[first + 1], tree.nbytes()
@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+import math
+import random
+from statistics import NormalDist
+from multiprocessing import Pool
+from modules.engine import get_geometry
+from modules.evaluation import default_weights
+from modules.records import write_record
+from modules.shared import publish_geometry
+from modules.tournament import _init_worker, game_key, play_game, read_cache
+
+'''
+   Tuning of the weights of the evaluation (modules.evaluation) by playing
+   games between heuristic players (HeuristicPlayer of modules.tournament).
+
+   The weights are tuned by SPSA (simultaneous perturbation stochastic
+   approximation): at each iteration, all weights are moved together by +c or
+   -c at random, a mini-match is played between the two perturbed vectors,
+   and the weights move towards the winner by a step proportional to its
+   margin. Every check_every iterations, the current weights play a match
+   against the best weights so far, and replace them if they win.
+
+   Games are played by a pool of processes and cached, as in a tournament, by
+   (configurations, seed, rules): weights are rounded to decimals digits, so
+   that a candidate met again (or a run started again with the same seed)
+   reuses its games instead of playing them again.
+
+   A match is played by batches of games, and stops as soon as its result is
+   clear: when the confidence interval of the score excludes 1/2 (the
+   candidate is clearly losing, or clearly winning), the remaining games are
+   not played.
+'''
+
+def score_interval(results, confidence = 0.95):
+    '''(mean, low, high) of the score of a list of results (1, 0.5 or 0) with a normal approximation.'''
+    n = len(results)
+    mean = sum(results) / n
+    variance = sum((r - mean) ** 2 for r in results) / max(n - 1, 1)
+    # At least the variance of one draw in n games, so that 2 wins out of 2 are not "certain"
+    variance = max(variance, 0.25 / n)
+    z = NormalDist().inv_cdf(0.5 + confidence / 2)
+    half = z * math.sqrt(variance / n)
+    return(mean, mean - half, mean + half)
+
+###############
+# Class Tuner #
+###############
+class Tuner():
+    '''
+    Tunes the weights names (all the weights of default_weights by default)
+    starting from start. parameters are the other parameters of the
+    HeuristicPlayer (e.g. candidates). A match has at most games games
+    (pairs of games with the same seed and swapped seats), played by batches
+    of batch_size games, and stops once min_games are played if its result is
+    clear at the level confidence.
+    '''
+    def __init__(self, names = None, start = None, parameters = None, cache_path = 'tuning.jsonl',
+                 board_size = 20, max_rank = 5, players = (0, 1, 0, 1), processes = None,
+                 games = 16, batch_size = 8, min_games = 8, confidence = 0.95, decimals = 2):
+        self.names = list(names) if names is not None else sorted(default_weights)
+        self.weights = dict(default_weights)
+        self.weights.update(start or {})
+        self.parameters = dict(parameters or {})
+        self.cache_path = cache_path
+        self.board_size = board_size
+        self.max_rank = max_rank
+        self.players = tuple(players)
+        self.processes = processes
+        self.games = games
+        self.batch_size = batch_size
+        self.min_games = min_games
+        self.confidence = confidence
+        self.decimals = decimals
+        self.records = read_cache(cache_path)
+        self.played = 0   # games played
+        self.cached = 0   # games found in the cache
+        self.skipped = 0  # games not played thanks to early stops
+        self.pool = None
+        self.block = None
+
+    def __enter__(self):
+        self.start()
+        return(self)
+
+    def __exit__(self, *args):
+        self.close()
+        return(False)
+
+    def start(self):
+        if self.processes != 1 and self.pool is None:
+            self.block = publish_geometry(get_geometry(self.board_size, self.max_rank))
+            self.pool = Pool(self.processes, initializer = _init_worker, initargs = (self.block.name,))
+        return(None)
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+        if self.block is not None:
+            self.block.close()
+            self.block.unlink()
+            self.block = None
+        return(None)
+
+    def config(self, weights):
+        '''Configuration of the heuristic player of weights, rounded.'''
+        rounded = {name: round(float(weights[name]), self.decimals) for name in sorted(weights)}
+        parameters = dict(self.parameters)
+        parameters['weights'] = rounded
+        return(('heuristic', parameters))
+
+    def task(self, configs, names, seed):
+        return({
+            'key': game_key(configs[0], configs[1], seed, self.players, self.board_size, self.max_rank),
+            'names': names,
+            'configs': configs,
+            'seed': seed,
+            'board_size': self.board_size,
+            'max_rank': self.max_rank,
+            'players': list(self.players),
+        })
+
+    def play(self, tasks):
+        '''Records of tasks, played by the pool when they are not in the cache.'''
+        todo = [task for task in tasks if task['key'] not in self.records]
+        self.cached += len(tasks) - len(todo)
+        if todo:
+            with open(self.cache_path, 'a') as f:
+                if self.pool is None:
+                    results = map(play_game, todo)
+                else:
+                    results = self.pool.imap_unordered(play_game, todo)
+                for record in results:
+                    write_record(f, record)
+                    self.records[record['key']] = record
+                    self.played += 1
+        return([self.records[task['key']] for task in tasks])
+
+    def match(self, a, b, seed = 0, early_stop = True):
+        '''
+        (score of weights a against weights b, number of games): games of
+        seeds seed, seed + 1, ..., each seed played twice with swapped seats.
+        '''
+        configs = (self.config(a), self.config(b))
+        if configs[0] == configs[1]:
+            return(0.5, 0)
+        tasks = []
+        for k in range(self.games // 2):
+            tasks.append(self.task([configs[0], configs[1]], ['a', 'b'], seed + k))
+            tasks.append(self.task([configs[1], configs[0]], ['b', 'a'], seed + k))
+        results = []
+        for first in range(0, len(tasks), self.batch_size):
+            batch = tasks[first:first + self.batch_size]
+            # A cached record keeps the names of the match which played it:
+            # player 0 is given by the configurations hashed in the key
+            for task, record in zip(batch, self.play(batch)):
+                result = record['result']
+                results.append(result if task['configs'][0] == configs[0] else 1.0 - result)
+            if early_stop and len(results) >= self.min_games and len(results) < len(tasks):
+                (_, low, high) = score_interval(results, self.confidence)
+                if high < 0.5 or low > 0.5:
+                    self.skipped += len(tasks) - len(results)
+                    break
+        return(sum(results) / len(results), len(results))
+
+    ##
+    # SPSA
+    ##
+    def spsa(self, iterations = 100, a = 1.0, c = 0.5, alpha = 0.602, gamma = 0.101,
+             check_every = 10, seed = 0, callback = None):
+        '''
+        Runs iterations iterations of SPSA from self.weights and returns the
+        best weights. a and c are the step and the perturbation of the first
+        iteration (decreasing as 1 / k ** alpha and 1 / k ** gamma).
+        callback(iteration, weights, score) is called after each iteration.
+        '''
+        rng = random.Random(seed)
+        stability = 0.1 * iterations
+        weights = dict(self.weights)
+        best = dict(weights)
+        game_seed = seed * 1000003
+        for k in range(1, iterations + 1):
+            a_k = a / (k + stability) ** alpha
+            c_k = c / k ** gamma
+            delta = {name: rng.choice((-1.0, 1.0)) for name in self.names}
+            plus = dict(weights)
+            minus = dict(weights)
+            for name in self.names:
+                plus[name] += c_k * delta[name]
+                minus[name] -= c_k * delta[name]
+            (score, nb_games) = self.match(plus, minus, game_seed)
+            game_seed += self.games // 2
+            # Gradient of the score of plus against minus, along delta
+            for name in self.names:
+                weights[name] += a_k * (2 * score - 1) / (2 * c_k) * delta[name]
+            if k % check_every == 0 or k == iterations:
+                (score_best, _) = self.match(weights, best, game_seed)
+                game_seed += self.games // 2
+                if score_best > 0.5:
+                    best = dict(weights)
+            if callback is not None:
+                callback(k, weights, score)
+        self.weights = best
+        return(best)
+
+    def stats(self):
+        return({'played': self.played, 'cached': self.cached, 'skipped': self.skipped})
+
+# # Example
+# with Tuner(names = ['exclusive', 'contested', 'usable_corners'],
+#            parameters = {'candidates': 8}, processes = 8) as tuner:
+#     best = tuner.spsa(iterations = 50, callback = lambda k, w, s: print(k, s, w, flush = True))
+#     print(tuner.stats())
+
+if __name__ == '__main__':
+    import argparse
+    import json
+    parser = argparse.ArgumentParser(description = 'Tuning of the weights of the evaluation by SPSA')
+    parser.add_argument('--iterations', type = int, default = 100)
+    parser.add_argument('--games', type = int, default = 16, help = 'max games of a match')
+    parser.add_argument('--candidates', type = int, default = 12)
+    parser.add_argument('--cache', default = 'tuning.jsonl')
+    parser.add_argument('--processes', type = int, default = None)
+    parser.add_argument('--seed', type = int, default = 0)
+    args = parser.parse_args()
+
+    with Tuner(parameters = {'candidates': args.candidates}, cache_path = args.cache,
+               processes = args.processes, games = args.games) as tuner:
+        best = tuner.spsa(args.iterations, seed = args.seed,
+                          callback = lambda k, weights, score: print(k, round(score, 3), flush = True))
+        print(json.dumps(best, indent = 1))
+        print(tuner.stats())
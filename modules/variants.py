@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+from array import array
+from modules.engine import Position, bits, get_geometry, start_cells
+
+'''
+   Variants of the game.
+
+   A variant gives the colors in game (in the order they play), the player of
+   each color, the board size, the max rank of the pieces, the cells where
+   each color starts, and optionally a custom set of pieces (the other pieces
+   of the bags are never played).
+
+   Registered variants:
+   - 'classic': 4 players, one color each, starts in the corners,
+   - '2 players 4 colors': players 0 and 1 play blue and red, yellow and green,
+   - '3 players': 3 players, one color each (the fourth color is not used),
+   - 'duo': 2 players on a 14 x 14 board, starting near the center,
+   and any variant added with register_variant, for example a variant
+   played with the pentominoes only.
+
+   Placement tables (modules.engine.Geometry) only depend on the board size
+   and the max rank, so variants of the same size share them. The other
+   tables of a variant (start cells, adjacency of the cells, symmetries of
+   the board which keep the start cells) are built once per (variant,
+   board_size, max_rank) by get_tables.
+'''
+
+#################
+# Class Variant #
+#################
+class Variant():
+    '''
+    starts is 'corners' (start cells of modules.engine) or 'center' (rules of
+    Blokus Duo), or a dict color -> (x, y). pieces is a list of piece names,
+    None for all the pieces of rank at most max_rank.
+    '''
+    def __init__(self, name, colors, players, board_size = 20, max_rank = 5,
+                 starts = 'corners', pieces = None):
+        if len(colors) != len(players):
+            raise ValueError("Size of lists 'colors' and 'players' must be equal")
+        if len(colors) > 4:
+            raise ValueError('At most four colors')
+        self.name = name
+        self.colors = list(colors)
+        self.players = list(players)
+        self.board_size = board_size
+        self.max_rank = max_rank
+        self.starts = starts
+        self.pieces = list(pieces) if pieces is not None else None
+        self.code = None # number of the variant in the registry
+
+    def __repr__(self):
+        return('Variant({!r})'.format(self.name))
+
+    def geometry(self):
+        return(get_geometry(self.board_size, self.max_rank))
+
+    def start_cells(self, board_size = None):
+        '''Cell that the first piece of each color must cover.'''
+        n = board_size if board_size is not None else self.board_size
+        if isinstance(self.starts, dict):
+            return(dict(self.starts))
+        if self.starts == 'center':
+            # Blokus Duo: (4, 4) and (9, 9) on a 14 x 14 board
+            cells = [(4, 4), (n - 5, n - 5), (4, n - 5), (n - 5, 4)]
+            return({color: cells[k] for k, color in enumerate(self.colors)})
+        corners = start_cells(n)
+        return({color: corners[color] for color in self.colors})
+
+    def piece_mask(self, geometry):
+        '''Bit set of the pieces of the variant (see Position.remaining).'''
+        if self.pieces is None:
+            return(geometry.all_pieces)
+        mask = 0
+        for name in self.pieces:
+            if name not in geometry.piece_index:
+                raise ValueError('Unknown piece {} for max rank {}'.format(name, geometry.max_rank))
+            mask |= 1 << geometry.piece_index[name]
+        return(mask)
+
+    def position(self):
+        '''Initial position of the variant.'''
+        return(Position(variant = self))
+
+############
+# Registry #
+############
+_variants = dict()
+_codes = [None] # _codes[code] is the variant; 0 is used for positions without variant
+
+def register_variant(variant):
+    '''
+    Adds a variant to the registry. Codes are given in the order of
+    registration: processes sharing snapshots (Position.to_bytes) must
+    register their custom variants in the same order.
+    '''
+    if variant.name in _variants:
+        raise ValueError('Variant {} is already registered'.format(variant.name))
+    if len(_codes) > 255:
+        raise ValueError('Too many variants')
+    variant.code = len(_codes)
+    _codes.append(variant)
+    _variants[variant.name] = variant
+    return(variant)
+
+def get_variant(name):
+    try:
+        return(_variants[name])
+    except KeyError:
+        raise ValueError('This gametype is not implemented yet: {}'.format(name))
+
+def variant_of_code(code):
+    if not 0 < code < len(_codes):
+        raise ValueError('Unknown variant number {}'.format(code))
+    return(_codes[code])
+
+def variant_names():
+    return(list(_variants))
+
+register_variant(Variant('classic', ['b', 'y', 'r', 'g'], [0, 1, 2, 3]))
+register_variant(Variant('2 players 4 colors', ['b', 'y', 'r', 'g'], [0, 1, 0, 1]))
+register_variant(Variant('3 players', ['b', 'y', 'r'], [0, 1, 2]))
+register_variant(Variant('duo', ['b', 'y'], [0, 1], board_size = 14, starts = 'center'))
+# # Example: custom set of pieces
+# register_variant(Variant('pentominoes duo', ['b', 'y'], [0, 1], board_size = 14,
+#                          starts = 'center', pieces = ['I5', 'L5', 'Y', 'P', 'U', 'V5',
+#                                                       'T5', 'N', 'F', 'W', 'Z5', 'X']))
+
+##########
+# Tables #
+##########
+# Symmetries of the square board, as functions of (x, y) and n = board_size - 1
+SYMMETRIES = [
+    lambda x, y, n: (x, y),
+    lambda x, y, n: (y, n - x),
+    lambda x, y, n: (n - x, n - y),
+    lambda x, y, n: (n - y, x),
+    lambda x, y, n: (y, x),
+    lambda x, y, n: (n - x, y),
+    lambda x, y, n: (n - y, n - x),
+    lambda x, y, n: (x, n - y),
+]
+
+#######################
+# Class VariantTables #
+#######################
+class VariantTables():
+    '''
+    Tables of a variant, built once (see get_tables):
+    - geometry: placement tables, shared by the variants of the same size,
+    - starts: bit set of the start cell of each color,
+    - edges[cell], corners[cell]: cells sharing an edge, a corner with cell,
+    - symmetries: list of (cells, placements, colors) for each symmetry of the
+      board mapping the start cells onto start cells: new cell of each cell,
+      new placement id of each placement id, new color number of each color.
+    '''
+    def __init__(self, variant, board_size, max_rank):
+        self.variant = variant
+        geometry = get_geometry(board_size, max_rank)
+        self.geometry = geometry
+        starts = variant.start_cells(board_size)
+        self.starts = [1 << geometry.cell(*starts[color]) for color in variant.colors]
+
+        self.edges = [0] * geometry.nb_cells
+        self.corners = [0] * geometry.nb_cells
+        for x in range(board_size):
+            for y in range(board_size):
+                cell = geometry.cell(x, y)
+                self.edges[cell] = geometry.edge_dilate(1 << cell)
+                self.corners[cell] = geometry.diagonal_dilate(1 << cell)
+
+        n = board_size - 1
+        start_colors = {starts[color]: k for k, color in enumerate(variant.colors)}
+        by_mask = None
+        self.symmetries = []
+        for symmetry in SYMMETRIES:
+            colors = [start_colors.get(symmetry(x, y, n)) for (x, y) in
+                      (starts[color] for color in variant.colors)]
+            if None in colors:
+                continue
+            if by_mask is None:
+                by_mask = {mask: pid for pid, mask in enumerate(geometry.masks)}
+            cells = array('i', [-1]) * geometry.nb_cells
+            for x in range(board_size):
+                for y in range(board_size):
+                    cells[geometry.cell(x, y)] = geometry.cell(*symmetry(x, y, n))
+            placements = array('i', [by_mask[sum(1 << cells[c] for c in bits(mask))]
+                                     for mask in geometry.masks])
+            self.symmetries.append((cells, placements, colors))
+
+    def transform_mask(self, mask, k):
+        '''Image of a bit set of cells by symmetry number k.'''
+        cells = self.symmetries[k][0]
+        output = 0
+        for c in bits(mask):
+            output |= 1 << cells[c]
+        return(output)
+
+_tables = dict()
+
+def get_tables(variant, board_size = None, max_rank = None):
+    '''Tables of a variant (a Variant or its name), built only once per process.'''
+    if not isinstance(variant, Variant):
+        variant = get_variant(variant)
+    board_size = board_size if board_size is not None else variant.board_size
+    max_rank = max_rank if max_rank is not None else variant.max_rank
+    key = (variant.name, board_size, max_rank)
+    if key not in _tables:
+        _tables[key] = VariantTables(variant, board_size, max_rank)
+    return(_tables[key])
+
+# # Example
+# duo = get_variant('duo')
+# position = duo.position()
+# len(position.legal_moves())
+# tables = get_tables(duo)
+# len(tables.symmetries) # identity, and the symmetries exchanging (4, 4) and (9, 9)